@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module provides an offline benchmark suite for the Yandexml engine. All requests go to
+a local stand-in for the Yandex XML server (see yxmlstub.py), so neither credentials nor network are needed.
+
+Measured:
+    - parse: parse_search_xml() throughput for 1, 10 and 100 groups (3 docs each)
+    - search: end-to-end search() latency percentiles
+    - stream: time to the first group with search_iter() vs the whole search()
+    - batch: search_many() throughput with server latency, failures and captchas
+    - memory: peak memory of a batch of 100-group pages
+
+The results are appended to a JSON history file and compared with the previous run, so that
+regressions show up between versions. Use this module like this:
+python benchmark.py --label="my version" [--outfile=benchmarks.json] [--quick=True]
+"""
+
+import sys
+import time
+import json
+import platform
+import tracemalloc
+import fire
+from datetime import datetime as dt
+from yxmlengine import Yandexml, parse_search_xml, print_help, print_err
+from yxmlstub import StubYandexServer, make_search_xml, STUB_CAPTCHA_ANSWER
+from globalvars import *
+
+BENCH_FILE = 'benchmarks.json'
+
+## ******************************************************************************** ##
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0
+
+def make_engine(server, **kwargs):
+    return Yandexml('bench', 'bench', 'world', ip='127.0.0.1', host=server.url, reentrant=True, **kwargs)
+
+def make_queries(n, prefix='benchmark query'):
+    return ['{} {}'.format(prefix, i) for i in range(n)]
+
+def bench_parse(repeat=50):
+    results = {}
+    for groups in (1, 10, 100):
+        xml = make_search_xml('benchmark query', groups=groups)
+        parse_search_xml(xml)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse_search_xml(xml)
+        elapsed = (time.perf_counter() - start) / repeat
+        results['parse_{}_groups_ms'.format(groups)] = elapsed * 1000
+        results['parse_{}_groups_docs_per_sec'.format(groups)] = groups * 3 / elapsed
+    return results
+
+def bench_search(n=200):
+    results = {}
+    for groups in (1, 100):
+        with StubYandexServer(groups=groups) as server, make_engine(server) as engine:
+            engine.search('warm up')
+            latencies = []
+            for query in make_queries(n):
+                start = time.perf_counter()
+                engine.search(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+        for p in (50, 90, 99):
+            results['search_{}_groups_p{}_ms'.format(groups, p)] = percentile(latencies, p)
+    return results
+
+def bench_stream(n=50):
+    with StubYandexServer(groups=100) as server, make_engine(server) as engine:
+        first, whole = [], []
+        for query in make_queries(n):
+            start = time.perf_counter()
+            for _ in engine.search_iter(query):
+                first.append((time.perf_counter() - start) * 1000)
+                break
+            start = time.perf_counter()
+            engine.search(query)
+            whole.append((time.perf_counter() - start) * 1000)
+    return {'stream_first_group_p50_ms': percentile(first, 50), 'stream_whole_search_p50_ms': percentile(whole, 50)}
+
+def bench_batch(n=300, workers=16, latency=0.02):
+    results = {}
+    scenarios = (('batch', {}), ('batch_failures', {'failure_rate': 0.1}), ('batch_captcha', {'captcha_rate': 0.3}))
+    for name, params in scenarios:
+        with StubYandexServer(groups=10, latency=latency, jitter=latency / 2, seed=1, **params) as server, \
+             make_engine(server, captcha_solver=lambda url: STUB_CAPTCHA_ANSWER, pool_maxsize=workers) as engine:
+            errors = 0
+            start = time.perf_counter()
+            for query, result in engine.search_many(make_queries(n, name), max_workers=workers):
+                if isinstance(result, Exception): errors += 1
+            elapsed = time.perf_counter() - start
+            results[name + '_queries_per_sec'] = n / elapsed
+            results[name + '_errors'] = errors
+    return results
+
+def bench_memory(n=100, workers=8):
+    with StubYandexServer(groups=100) as server, make_engine(server, pool_maxsize=workers) as engine:
+        tracemalloc.start()
+        for query, result in engine.search_many(make_queries(n), max_workers=workers):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'memory_batch_100_groups_peak_mb': peak / 2 ** 20}
+
+def compare(current, previous, threshold=0.1):
+    """
+    Prints the metrics that got worse than in the previous run by more than 'threshold' (share).
+    """
+    regressions = 0
+    for name, value in current['results'].items():
+        old = previous['results'].get(name)
+        if not old or name.endswith('_errors'): continue
+        change = (value - old) / old
+        worse = -change if name.endswith('_per_sec') else change
+        if worse > threshold:
+            regressions += 1
+            print_err('REGRESSION: {} = {:.3f} (was {:.3f} in "{}", {:+.0%})'.format(name, value, old, previous['label'], change))
+    if not regressions:
+        print_help('No regressions against "{}" (threshold {:.0%})'.format(previous['label'], threshold))
+    return regressions
+
+def run(label='', outfile=BENCH_FILE, quick=False, threshold=0.1):
+    """
+    Runs all the benchmarks, prints the results and appends them to 'outfile' (JSON list).
+
+    PARAMS:
+        - label [str]: name of this run (e.g. version)
+        - outfile [str|None]: path to the results history file (None = don't save)
+        - quick [bool]: run fewer iterations
+        - threshold [float]: share by which a metric may get worse before it is reported as a regression
+    RETURNS:
+        number of regressions against the previous run [int]
+    """
+    scale = 5 if quick else 1
+    results = {}
+    for bench, kwargs in ((bench_parse, {'repeat': 50 // scale}), (bench_search, {'n': 200 // scale}),
+                          (bench_stream, {'n': 50 // scale}), (bench_batch, {'n': 300 // scale}),
+                          (bench_memory, {'n': 100 // scale})):
+        print_help('Running {}...'.format(bench.__name__))
+        results.update(bench(**kwargs))
+
+    for name, value in results.items():
+        print('{:<45}{:>12.3f}'.format(name, value))
+
+    current = {'label': label or dt.now().strftime('%Y-%m-%d %H:%M:%S'), 'timestamp': dt.now().isoformat(),
+               'python': platform.python_version(), 'platform': platform.platform(), 'quick': quick, 'results': results}
+    if not outfile:
+        return 0
+    try:
+        with open(outfile, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+    except (OSError, ValueError):
+        history = []
+    previous = next((entry for entry in reversed(history) if entry.get('quick') == quick), None)
+    history.append(current)
+    with open(outfile, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=4)
+    return compare(current, previous, threshold) if previous else 0
+
+## ******************************************************************************** ##
+
+def main(argv=None):
+    """
+    Command-line entry point: runs the benchmarks (see run()) with the given arguments (None = sys.argv).
+    RETURNS:
+        exit status [int]: 1 if there are regressions against the previous run, otherwise 0
+    """
+    regressions = []
+    def bench(label='', outfile=BENCH_FILE, quick=False, threshold=0.1):
+        regressions.append(run(label, outfile, quick, threshold))
+    bench.__doc__ = run.__doc__
+    fire.Fire(bench, argv)
+    return 1 if any(regressions) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,8 @@ This file is part of the Pynxml project hosted at https://github.com/S0mbre/yand
 This module contains the global variables used in any other modules.
 """
 
+import os
+
 # debug messages
 DEBUGGING = True
 
@@ -35,8 +37,64 @@ REQ_HEADERS = {'Content-Type': 'text/xhtml+xml; charset=UTF-8',
                'Accept': 'application/xhtml+xml,application/xml', 
                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36',
                'Accept-Charset': 'utf-8',
+               'Accept-Encoding': 'gzip, deflate',
                'Accept-Language': 'ru,en-us',
-               'Connection': 'close'}
+               'Connection': 'keep-alive'}
+# HTTP connection pool (shared by all requests of a single Yandexml engine)
+POOL_CONNECTIONS = 4            # number of hosts (yandex.com, yandex.ru, IP services...) to keep pools for
+POOL_MAXSIZE = 10               # max number of kept-alive connections per host
+POOL_BLOCK = False              # True = never open more than POOL_MAXSIZE connections per host (wait for a free one)
+KEEP_ALIVE = True               # False = close connection after each request
+MAX_CONCURRENT_REQUESTS = 100   # max number of requests in flight (AsyncYandexml)
+STREAM_CHUNK_SIZE = 16384      # bytes read from the response at a time by the streaming search (search_iter)
+KEEP_RAW_XML = True             # keep the XML of the search results (SearchResult.raw_results, for output_results('xml')); False = save memory
+MAX_CAPTCHA_ROUNDS = 3          # max number of times a query is resent after a solved captcha
+# search retries, deadlines and hedged requests (Yandexml)
+SEARCH_RETRIES = 2              # number of times a search request is resent after a network error, timeout or HTTP 5xx / 429
+RETRY_BACKOFF = 0.5             # first retry delay (sec.), doubled on each retry (the actual delay is random between 0 and it)
+RETRY_MAX_BACKOFF = 8           # max retry delay (sec.)
+QUERY_TIMEOUT = 0               # max time (sec.) a query may take, including the retries and captchas, 0 = no limit
+HEDGE_SAMPLES = 200             # number of recent search latencies the hedge delay (95th percentile) is computed from
+HEDGE_MIN_SAMPLES = 20          # no hedged requests before this many latencies have been measured
+# robot check (captcha) queue (yxmlengine.CaptchaQueue)
+CAPTCHA_WORKERS = 1             # number of threads solving captchas
+CAPTCHA_RETRIES = 5             # max number of captchas solved in a row (wrong answers bring new ones), 0 = unlimited
+CAPTCHA_TIMEOUT = 300           # max time (sec.) the queries wait for a captcha to be solved, 0 = no limit
+CAPTCHA_WORKER_IDLE = 60        # time (sec.) after which an idle captcha worker thread exits
+CAPTCHA_SOLVER_TIMEOUT = 60     # max time (sec.) a solver process (yxmlsolver.SolverPool) may take to solve a captcha
+CAPTCHA_SOLVER_START_TIMEOUT = 120  # max time (sec.) a solver process may take to start
+# proxy pool (yxmlproxy.ProxyPool)
+PROXY_EWMA_ALPHA = 0.2          # weight of the latest request in the proxies' latency / success / captcha averages
+PROXY_MAX_FAILURES = 2          # number of failures in a row after which a proxy is quarantined
+PROXY_BACKOFF = 10              # first quarantine (sec.), doubled on each repeated failure
+PROXY_MAX_BACKOFF = 600         # max quarantine (sec.)
+PROXY_PROBE_INTERVAL = 60       # interval (sec.) between background checks of each proxy, 0 = no checks
+PROXY_WAIT = 60                 # max time (sec.) to wait for a proxy when all of them are quarantined
+PROXY_RETRIES = 2               # number of times a search request failed by a proxy is resent through another one
+# search results cache (yxmlcache.SearchCache)
+CACHE_TTL = 86400               # time-to-live of cached results (sec.), 0 = never expire
+CACHE_MAX_ITEMS = 1000          # max number of results kept in memory
+CACHE_MAX_DISK_ITEMS = 100000   # max number of results kept in the cache database
+# request limits scheduler (yxmlquota.QuotaScheduler)
+QUOTA_REFRESH = 600             # interval (sec.) between limits updates (query_limits)
+QUOTA_RETRY_DELAY = 30          # interval (sec.) before a failed limits update is retried
+QUOTA_DAY_UTC_OFFSET = 3        # daily limits are reset at midnight in this time zone (Moscow time)
+# credentials pool (yxmlpool.AccountPool)
+ACCOUNT_QUARANTINE = 600        # time (sec.) an account is put aside after error 48 or a failed captcha
+ACCOUNT_REROUTES = 3            # max number of times a query is resent to another account (after errors 32 / 48 / 100)
+# crawl jobs (yxmljobs.CrawlJob)
+JOB_MAX_ATTEMPTS = 3            # max number of times a failed or captcha-blocked query is run
+JOB_RETRY_DELAY = 60            # pause (sec.) before the failed queries are run again
+JOB_LIMITS_WAIT = 600           # pause (sec.) after error 32 when the limits don't tell when the next interval starts
+JOB_RATE_WAIT = 5               # pause (sec.) after error 55 (requests per second limit exceeded)
+JOB_FETCH_SIZE = 1000           # number of queries read from the journal at a time
+JOB_FATAL_ERRORS = (31, 42, 43, 44, 48)     # Yandex errors that stop the job (account, key, IP or search type not accepted)
+JOB_PERMANENT_ERRORS = (1, 2, 15, 18, 19, 37)     # Yandex errors that won't change on a rerun (query syntax, empty query, nothing found, bad request)
+# results export (yxmlexport.py)
+EXPORT_BUFFER_SIZE = 1048576    # write buffer (bytes) of the export files
+# query preprocessing (yxmlqueries.py)
+QUERY_BODY_CACHE_SIZE = 10000   # number of request bodies memoized by make_query_body()
+QUERY_REPORT_LIMIT = 1000       # max number of rejected / truncated queries listed in the preprocessing report (all are counted)
 MAX_QUERY_WORDS = 40
 MAX_QUERY_CHARS = 400
 MAX_PASSAGES = 5
@@ -48,6 +106,7 @@ XML_QUERY = \
 r"""
 <request>    
 <query>{{}}</query>
+<page>{{}}</page>
 <maxpassages>{}</maxpassages>
 <groupings>
 <groupby attr="{{}}" mode="{{}}" groups-on-page="{}" docs-in-group="{{}}" />
@@ -57,6 +116,8 @@ r"""
 
 STOP_SYMBS = list('.,:;?~!@#$%^&*()+=_<>{}[]\\|/"\'')
 IPSERVICES = ['https://api.ipify.org', 'https://ident.me', 'https://ipecho.net/plain', 'https://myexternalip.com/raw']
+IP_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'yandexml', 'ip.json')   # host IP cache shared by the user's processes ('' = don't cache)
+IP_CACHE_TTL = 3600             # time-to-live of the cached host IP (sec.)
 SAMPLE_CAPTCHA_QUERY = 'e48a2b93de1740f48f6de0d45dc4192a'
 
 HTML_LOGO_TEMPLATE_FULL = \
@@ -47,11 +47,11 @@ def main():
     def run2():
         # manual results output to console (first 20 found docs)
         for group in yxml.groups[:min(20, len(yxml.groups))]:
-            print('\n\n----------------\nDOMAIN "{}": {}'.format(group['name'], group['count']))
-            for doc in group['docs']:
+            print('\n\n----------------\nDOMAIN "{}": {}'.format(group.name, group.count))
+            for doc in group.docs:
                 print('\n\tURL: {}\n\tTITLE: {}\n\tHEADLINE: {}\n\tLANGUAGE: {}\n\tMODIFIED: {}\n\tPASSAGES: {}'.format(
-                        doc['url'], doc['title'], doc['headline'], doc['language'], doc['modified'],  
-                        '\n\t\t'.join(doc['passages']) if doc['passages'] else ''))
+                        doc.url, doc.title, doc.headline, doc.language, doc.modified,  
+                        '\n\t\t'.join(doc.passages)))
         
     def run3():
         # show daily limit
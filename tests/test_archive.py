@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the raw responses archive (yxmlarchive.SearchArchive), including the index recovery
+after an interrupted write.
+"""
+
+import os
+import pytest
+from yxmlarchive import SearchArchive
+from yxmlengine import Yandexml, SearchResult
+from yxmlstub import StubYandexServer, make_search_xml
+
+def xml(query):
+    return make_search_xml(query, groups=2, docs_in_group=1)
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'archive.dat')
+
+def test_put_get_reopen(path):
+    with SearchArchive(path) as archive:
+        archive.put('query', True, 'world', 0, xml('first'), created=100)
+        archive.put(' query ', True, 'world', 0, xml('second').encode('utf-8'), created=200)
+        archive.put('query', False, 'world', 0, xml('other'), created=300)
+    with SearchArchive(path) as archive:
+        assert len(archive) == 3
+        assert archive.get('query') == xml('second')
+        assert archive.get('query', before=150) == xml('first')
+        assert archive.get('query', mode='ru') is None
+        assert [entry.created for entry in archive.find(grouped=True)] == [100, 200]
+        assert [entry.created for entry in archive.find(since=150, until=300)] == [200]
+
+def test_recovers_incomplete_index_line(path):
+    with SearchArchive(path) as archive:
+        archive.put('query 1', True, 'world', 0, xml('query 1'))
+    # a write interrupted in the middle of an index line
+    with open(path + '.idx', 'a', encoding='utf-8') as f:
+        f.write('["query 2", true, "wor')
+    with SearchArchive(path) as archive:
+        assert len(archive) == 1
+        archive.put('query 3', True, 'world', 0, xml('query 3'))
+    with SearchArchive(path) as archive:
+        assert [entry.query for entry in archive.find()] == ['query 1', 'query 3']
+        assert archive.get('query 3') == xml('query 3')
+
+def test_skips_entries_past_the_data(path):
+    with SearchArchive(path) as archive:
+        archive.put('query 1', True, 'world', 0, xml('query 1'))
+        entry = archive.put('query 2', True, 'world', 0, xml('query 2'))
+    # the data of the last response has been lost
+    with open(path, 'r+b') as f:
+        f.truncate(entry.offset + entry.size - 1)
+    with SearchArchive(path) as archive:
+        assert [entry.query for entry in archive.find()] == ['query 1']
+        assert archive.get('query 2') is None
+
+def test_reparse(path):
+    with SearchArchive(path) as archive:
+        archive.put('good', True, 'world', 0, xml('good'))
+        archive.put('bad', True, 'world', 0, '<yandexsearch><broken')
+        results = dict((entry.query, result) for entry, result in archive.reparse())
+    assert isinstance(results['good'], SearchResult) and len(results['good'].groups) == 2
+    assert isinstance(results['bad'], Exception)
+
+def test_engine_archives_responses(path):
+    with StubYandexServer(groups=100, docs_in_group=1, found=150) as server, SearchArchive(path) as archive:
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True, archive=archive)
+        result = engine.search('query', pages=2)
+        engine.close()
+        assert [entry.page for entry in archive.find(query='query')] == [0, 1]
+        pages = [result for _, result in archive.reparse()]
+    assert sum(len(page.groups) for page in pages) == len(result.groups) == 150
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the unattended batch command of the CLI (yxml.Pyndxml.batch) against the local stub server.
+"""
+
+import io
+import sys
+import json
+import builtins
+import webbrowser
+import pytest
+from yxml import Pyndxml
+from yxmlstub import StubYandexServer, STUB_CAPTCHA_ANSWER
+
+QUERIES = ['query number {}'.format(i) for i in range(6)]
+
+@pytest.fixture
+def stdin_queries(monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO('\n'.join(QUERIES).encode('utf-8')), encoding='utf-8'))
+
+@pytest.fixture
+def no_console(monkeypatch):
+    # the batch must never ask for a captcha at the console
+    def fail(*args, **kwargs):
+        raise AssertionError('interactive captcha prompt in batch mode')
+    monkeypatch.setattr(builtins, 'input', fail)
+    monkeypatch.setattr(webbrowser, 'open_new_tab', fail)
+
+def make_cli(server, **kwargs):
+    cli = Pyndxml('user', 'apikey', 'world', ip='127.0.0.1', **kwargs)
+    cli.engine.reset(host=server.url)
+    return cli
+
+def read_records(out):
+    # each stdout line must be a JSON record (no prompts or diagnostics mixed in)
+    return [json.loads(line) for line in out.splitlines() if line.strip()]
+
+def test_batch_captcha_without_solver(stdin_queries, no_console, capsys):
+    with StubYandexServer(groups=2, docs_in_group=1, captcha_rate=0.5, seed=1) as server:
+        cli = make_cli(server)
+        cli.batch('-', workers=2)
+        assert cli.engine.captcha_solver is Pyndxml.default_captcha_callback
+        cli.engine.close()
+    out, err = capsys.readouterr()
+    records = read_records(out)
+    failed = sum(1 for line in err.splitlines() if line.count('"query number') == 1 and 'капч' in line.lower())
+    assert 0 < failed < len(QUERIES)
+    assert len({r['query'] for r in records}) == len(QUERIES) - failed
+    assert 'RESULTS: {} succeeded, {} failed'.format(len(QUERIES) - failed, failed) in err
+
+def test_batch_captcha_with_solver(stdin_queries, no_console, capsys):
+    with StubYandexServer(groups=2, docs_in_group=1, captcha_rate=0.5, seed=1) as server:
+        cli = make_cli(server, captcha_solver=lambda url: STUB_CAPTCHA_ANSWER)
+        cli.batch('-', workers=2)
+        cli.engine.close()
+    out, err = capsys.readouterr()
+    assert {r['query'] for r in read_records(out)} == set(QUERIES)
+    assert 'RESULTS: {} succeeded, 0 failed'.format(len(QUERIES)) in err
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the two-tier search results cache (yxmlcache.SearchCache).
+"""
+
+import types
+import pytest
+import yxmlcache
+from yxmlcache import SearchCache
+from yxmlengine import Yandexml, parse_search_xml
+from yxmlstub import StubYandexServer, make_search_xml
+
+def make_result(query):
+    return parse_search_xml(make_search_xml(query, groups=2, docs_in_group=1).encode('utf-8'))
+
+@pytest.fixture
+def clock(monkeypatch):
+    # the cache's time, moved forward by the tests
+    now = [1000000.0]
+    monkeypatch.setattr(yxmlcache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+def test_memory_lru():
+    cache = SearchCache(max_items=2)
+    keys = [SearchCache.make_key('query {}'.format(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, make_result(key))
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) is not None
+    assert cache.stats['evictions'] == 1
+    assert cache.stats['memory_hits'] == 1 and cache.stats['misses'] == 1
+
+def test_make_key_normalizes():
+    assert SearchCache.make_key('  some   query ') == SearchCache.make_key('some query')
+    assert SearchCache.make_key('query', True) != SearchCache.make_key('query', False)
+    assert SearchCache.make_key('query', mode='world') != SearchCache.make_key('query', mode='ru')
+
+def test_disk_tier(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    key = SearchCache.make_key('query')
+    result = make_result('query')
+    with SearchCache(path) as cache:
+        cache.put(key, result)
+    with SearchCache(path) as cache:
+        cached = cache.get(key)
+        assert cached.groups == result.groups and cached.found == result.found
+        assert cache.stats['disk_hits'] == 1
+        # promoted to the memory tier
+        assert cache.get(key) is cached
+        assert cache.stats['memory_hits'] == 1
+
+def test_disk_eviction(tmp_path):
+    with SearchCache(str(tmp_path / 'cache.db'), max_items=1, max_disk_items=2) as cache:
+        keys = [SearchCache.make_key('query {}'.format(i)) for i in range(3)]
+        for key in keys:
+            cache.put(key, make_result(key))
+        cache._items.clear()
+        assert cache.get(keys[0]) is None
+        assert cache.get(keys[1]) is not None and cache.get(keys[2]) is not None
+
+def test_ttl(tmp_path, clock):
+    with SearchCache(str(tmp_path / 'cache.db'), ttl=60) as cache:
+        key = SearchCache.make_key('query')
+        cache.put(key, make_result('query'))
+        clock[0] += 59
+        assert cache.get(key) is not None
+        clock[0] += 2
+        # expired in both tiers
+        assert cache.get(key) is None
+        cache.clear(expired_only=True)
+        assert cache.db.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+
+def test_engine_uses_cache(tmp_path):
+    with StubYandexServer(groups=2, docs_in_group=1) as server, SearchCache(str(tmp_path / 'cache.db')) as cache:
+        # the XML goes to the disk tier even if the results don't keep it
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True, cache=cache, keep_raw=False)
+        first = engine.search('query')
+        assert engine.search(' query ') is first
+        assert engine.search('query', grouped=False) is not None
+        assert server.stats['search'] == 2
+        cache._items.clear()
+        assert engine.search('query').groups == first.groups
+        assert server.stats['search'] == 2 and cache.stats['disk_hits'] == 1
+        engine.close()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the captcha queue (yxmlengine.CaptchaQueue): parking of the robot-checked queries,
+shared tickets and expiry, against the local stub server.
+"""
+
+import time
+import threading
+import pytest
+from yxmlengine import Yandexml, CaptchaQueue, CaptchaError, QueryTimeout
+from yxmlstub import StubYandexServer, STUB_CAPTCHA_ANSWER
+
+QUERIES = ['query number {}'.format(i) for i in range(10)]
+
+class Solver:
+    # counts the captchas and answers them after 'delay' seconds (or when released)
+
+    def __init__(self, delay=0.0, answer=STUB_CAPTCHA_ANSWER):
+        self.delay = delay
+        self.answer = answer
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self, url):
+        self.calls += 1
+        self.release.wait(self.delay)
+        return self.answer
+
+@pytest.fixture
+def server():
+    # every request without the robot check cookie gets a captcha
+    with StubYandexServer(groups=2, docs_in_group=1, captcha_rate=1.0) as server:
+        yield server
+
+def make_engine(server, solver, queue, **kwargs):
+    return Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True,
+                    captcha_solver=solver, captcha_queue=queue, **kwargs)
+
+def test_parked_queries_share_one_captcha(server):
+    solver = Solver(delay=0.5)
+    queue = CaptchaQueue()
+    engine = make_engine(server, solver, queue)
+    results = dict(engine.search_many(QUERIES, max_workers=4))
+    engine.close()
+    queue.close()
+    assert all(not isinstance(result, Exception) for result in results.values())
+    assert sorted(results) == QUERIES
+    assert solver.calls == 1
+    assert server.stats['captchas_solved'] == 1
+    assert queue.stats['submitted'] == 1 and queue.stats['solved'] == 1
+    # the queries sent before the captcha was passed are resent after it
+    assert server.stats['search'] == len(QUERIES) + server.stats['captchas']
+
+def test_parked_queries_resume_after_captcha(server):
+    # the parked queries are resumed when the captcha is passed, none of them fails while waiting
+    solver = Solver(delay=1.0)
+    queue = CaptchaQueue()
+    blocked = make_engine(server, solver, queue)
+    started = time.time()
+    results = blocked.search_many(QUERIES[:4], max_workers=2)
+    first = next(results)
+    assert time.time() - started >= 0.9
+    assert not isinstance(first[1], Exception)
+    rest = list(results)
+    assert len(rest) == 3 and all(not isinstance(result, Exception) for _, result in rest)
+    blocked.close()
+    queue.close()
+
+def test_ticket_expiry(server):
+    solver = Solver(delay=5.0)
+    queue = CaptchaQueue(timeout=0.3)
+    engine = make_engine(server, solver, queue)
+    started = time.time()
+    results = dict(engine.search_many(QUERIES[:4], max_workers=2))
+    assert time.time() - started < 3
+    assert all(isinstance(result, CaptchaError) for result in results.values())
+    assert queue.stats['expired'] == 1
+    solver.release.set()
+    engine.close()
+    queue.close()
+
+def test_query_deadline_before_ticket(server):
+    solver = Solver(delay=5.0)
+    queue = CaptchaQueue()
+    engine = make_engine(server, solver, queue, query_timeout=0.3)
+    results = dict(engine.search_many(QUERIES[:3], max_workers=2))
+    assert all(isinstance(result, QueryTimeout) for result in results.values())
+    solver.release.set()
+    engine.close()
+    queue.close()
+
+def test_wrong_answers_limit(server):
+    solver = Solver(answer='wrong')
+    queue = CaptchaQueue(retries=2)
+    engine = make_engine(server, solver, queue)
+    results = dict(engine.search_many(QUERIES[:3], max_workers=2))
+    assert all(isinstance(result, CaptchaError) for result in results.values())
+    assert solver.calls == 2
+    assert queue.stats['failed'] == 1
+    engine.close()
+    queue.close()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the captcha attempts limit ('retries', CAPTCHA_RETRIES): both engines read 0 as unlimited.
+"""
+
+import asyncio
+import pytest
+from yxmlengine import Yandexml
+from yxmlstub import StubYandexServer, STUB_CAPTCHA_ANSWER
+
+def make_solver(wrong):
+    # answers the first 'wrong' captchas wrongly
+    answers = iter(['wrong'] * wrong)
+    return lambda url: next(answers, STUB_CAPTCHA_ANSWER)
+
+@pytest.mark.parametrize('retries, wrong, solved', [(0, 4, True), (3, 2, True), (3, 3, False)])
+def test_sync_retries(retries, wrong, solved):
+    with StubYandexServer() as server:
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, captcha_solver=make_solver(wrong))
+        assert engine.process_captcha(engine._get_sample_captcha(), retries, False) == solved
+        engine.close()
+
+@pytest.mark.parametrize('retries, wrong, solved', [(0, 4, True), (3, 2, True), (3, 3, False)])
+def test_async_retries(retries, wrong, solved):
+    pytest.importorskip('aiohttp')
+    from yxmlasync import AsyncYandexml
+
+    async def run(url):
+        engine = AsyncYandexml('user', 'apikey', 'world', ip='127.0.0.1', host=url, captcha_solver=make_solver(wrong))
+        try:
+            return await engine.solve_sample_captcha(retries)
+        finally:
+            await engine.close()
+
+    with StubYandexServer() as server:
+        assert asyncio.run(run(server.url)) == solved
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the coalescing of identical concurrent search requests (single flight) against the local stub server.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from yxmlengine import Yandexml
+from yxmlstub import StubYandexServer
+
+N = 8
+
+@pytest.fixture
+def server():
+    with StubYandexServer(groups=2, docs_in_group=1, latency=0.3) as server:
+        yield server
+
+@pytest.fixture
+def engine(server):
+    engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True, pool_maxsize=N)
+    yield engine
+    engine.close()
+
+def search_all(engine, queries):
+    # starts all the searches at once
+    barrier = threading.Barrier(len(queries))
+    def search(query):
+        barrier.wait()
+        return engine.search(query)
+    with ThreadPoolExecutor(len(queries)) as pool:
+        return list(pool.map(search, queries))
+
+def test_identical_queries_coalesced(engine, server):
+    results = search_all(engine, ['same query'] + [' same  query '] * (N - 1))
+    assert server.stats['search'] == 1
+    assert all(result is results[0] for result in results)
+    assert engine.metrics.snapshot()['coalesced'] == N - 1
+    # the finished request is not shared any more
+    engine.search('same query')
+    assert server.stats['search'] == 2
+    assert not engine._inflight
+
+def test_different_queries_not_coalesced(engine, server):
+    results = search_all(engine, ['query {}'.format(i % 4) for i in range(N)])
+    assert server.stats['search'] == 4
+    assert all(result is not None for result in results)
+
+def test_error_shared(engine, server):
+    server.error_code = 15
+    results = search_all(engine, ['same query'] * N)
+    assert results == [None] * N
+    assert server.stats['search'] == 1
+    assert not engine._inflight
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the cookie store (yxmlcookies.CookieStore) and its inter-process file lock.
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from http.cookies import Morsel
+import pytest
+from yxmlcookies import CookieStore, _FileLock
+
+URL = 'https://yandex.ru/search/xml'
+
+def morsel(name, value, domain='yandex.ru', max_age=''):
+    cookie = Morsel()
+    cookie.set(name, value, value)
+    cookie['domain'] = domain
+    cookie['path'] = '/'
+    cookie['max-age'] = max_age
+    return cookie
+
+def store_cookies(path, names):
+    # run in a child process: every cookie is stored with a separate update (lock, reload, merge, save)
+    store = CookieStore(path)
+    for name in names:
+        store.update('scope', [morsel(name, 'value')], URL)
+
+def test_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / 'lockfile')
+    inside = []
+    overlaps = []
+
+    def work():
+        for _ in range(20):
+            with _FileLock(path):
+                inside.append(1)
+                if len(inside) > 1:
+                    overlaps.append(1)
+                time.sleep(0.001)
+                inside.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert not overlaps
+    assert not os.path.exists(path)
+
+def test_lock_timeout(tmp_path):
+    path = str(tmp_path / 'lockfile')
+    with _FileLock(path):
+        started = time.time()
+        with pytest.raises(TimeoutError):
+            with _FileLock(path, timeout=0.2):
+                pass
+        assert time.time() - started >= 0.2
+    # the lock file of the holder is removed, not left by the one that timed out
+    assert not os.path.exists(path)
+
+def test_stale_lock_is_broken(tmp_path):
+    path = str(tmp_path / 'lockfile')
+    open(path, 'w').close()
+    old = time.time() - 60
+    os.utime(path, (old, old))
+    started = time.time()
+    with _FileLock(path, timeout=5, stale=30):
+        assert time.time() - started < 1
+    assert not os.path.exists(path)
+
+def test_processes_dont_lose_updates(tmp_path):
+    path = str(tmp_path / 'cookies.json')
+    names = [['p{}_{}'.format(p, i) for i in range(10)] for p in range(4)]
+    processes = [multiprocessing.Process(target=store_cookies, args=(path, chunk)) for chunk in names]
+    for process in processes: process.start()
+    for process in processes: process.join(30)
+    assert all(process.exitcode == 0 for process in processes)
+    assert not os.path.exists(path + '.lock')
+    cookies = CookieStore(path).get('scope', URL)
+    assert sorted(cookies) == sorted(name for chunk in names for name in chunk)
+
+def test_reload_and_scopes(tmp_path):
+    path = str(tmp_path / 'cookies.json')
+    first, second = CookieStore(path), CookieStore(path)
+    first.update('a', [morsel('spravka', '1')], URL)
+    assert second.get('a', URL) == {'spravka': '1'}
+    assert second.get('b', URL) == {}
+    # domain matching: not sent to another domain, sent to a subdomain
+    assert second.get('a', 'https://yandex.com/search/xml') == {}
+    assert second.get('a', 'https://xml.yandex.ru/search') == {'spravka': '1'}
+    second.update('a', [morsel('spravka', '', max_age='0')], URL)
+    assert first.get('a', URL) == {}
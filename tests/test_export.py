@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming results writers (yxmlexport.py).
+"""
+
+import io
+import csv
+import sys
+import gzip
+import json
+from yxmlengine import Yandexml, parse_search_xml
+from yxmlexport import CsvWriter, JsonLinesWriter, EXPORT_FIELDS
+from yxmlstub import StubYandexServer, make_search_xml
+
+RESULT = parse_search_xml(make_search_xml('query', groups=2, docs_in_group=2))
+
+class PipeStream(io.StringIO):
+    # a stream that can't be seeked (like stdout piped to another process)
+    def seekable(self):
+        return False
+
+def read_csv(text):
+    return list(csv.reader(io.StringIO(text)))
+
+def test_csv_header_on_streams():
+    for out in (io.StringIO(), PipeStream()):
+        with CsvWriter(out) as writer:
+            assert writer.write(RESULT) == 4
+        rows = read_csv(out.getvalue())
+        assert tuple(rows[0]) == EXPORT_FIELDS
+        assert len(rows) == 5
+
+def test_csv_no_header_when_appending():
+    out = io.StringIO()
+    out.write('existing,rows\n')
+    with CsvWriter(out) as writer:
+        writer.write(RESULT)
+    assert read_csv(out.getvalue())[1][0] == 'query'
+    out = io.StringIO()
+    with CsvWriter(out, header=False) as writer:
+        writer.write(RESULT)
+    assert read_csv(out.getvalue())[0][0] == 'query'
+
+def test_csv_file_header_once(tmp_path):
+    path = str(tmp_path / 'results.csv.gz')
+    for _ in range(2):
+        with CsvWriter(path) as writer:
+            writer.write(RESULT)
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+    assert len(rows) == 9
+    assert sum(1 for row in rows if tuple(row) == EXPORT_FIELDS) == 1
+
+def test_jsonl_rows():
+    out = io.StringIO()
+    with JsonLinesWriter(out) as writer:
+        assert writer.write_many([('query', RESULT), ('bad', ValueError('failed'))]) == 4
+        assert writer.errors == 1
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [record['position'] for record in records] == [1, 1, 2, 2]
+    assert set(records[0]) == set(EXPORT_FIELDS)
+
+def test_output_results_csv_to_stdout(capsys):
+    engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1')
+    engine.output_results('csv', sys.stdout, result=RESULT)
+    rows = read_csv(capsys.readouterr().out)
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    assert len(rows) == 5
+
+def test_batch_csv_to_stdout(monkeypatch, capsys):
+    from yxml import Pyndxml
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(b'first query\nsecond query\n'), encoding='utf-8'))
+    with StubYandexServer(groups=2, docs_in_group=1) as server:
+        cli = Pyndxml('user', 'apikey', 'world', ip='127.0.0.1')
+        cli.engine.reset(host=server.url)
+        cli.batch('-', workers=2, txtformat='csv')
+        cli.engine.close()
+    rows = read_csv(capsys.readouterr().out)
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    assert len(rows) == 5
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the resumable crawl jobs (yxmljobs.CrawlJob) against the local stub server.
+"""
+
+import threading
+import pytest
+import yxmljobs
+from yxmlengine import Yandexml
+from yxmljobs import CrawlJob
+from yxmlstub import StubYandexServer
+
+QUERIES = ['query number {}'.format(i) for i in range(5)]
+
+@pytest.fixture
+def server():
+    with StubYandexServer(groups=2, docs_in_group=1) as server:
+        yield server
+
+@pytest.fixture
+def engine(server):
+    engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url)
+    yield engine
+    engine.close()
+
+def make_job(tmp_path, engine, **kwargs):
+    job = CrawlJob(str(tmp_path / 'crawl.db'), engine, max_workers=2, retry_delay=0, **kwargs)
+    job.add(QUERIES)
+    return job
+
+def test_rate_limit_backs_off_and_keeps_queries(tmp_path, engine, server, monkeypatch):
+    monkeypatch.setattr(yxmljobs, 'JOB_RATE_WAIT', 0.2)
+    server.error_code = 55
+    timer = threading.Timer(0.5, setattr, (server, 'error_code', 0))
+    timer.start()
+    with make_job(tmp_path, engine, max_attempts=1) as job:
+        done = [query for query, result in job.run()]
+        assert sorted(done) == QUERIES
+        assert job.counts()['done'] == len(QUERIES)
+        assert job.stats['rate_waits'] >= 1
+        assert job.stats['failed'] == 0
+    timer.join()
+
+def test_permanent_error_not_retried(tmp_path, engine, server):
+    server.error_code = 15
+    with make_job(tmp_path, engine, max_attempts=3) as job:
+        assert list(job.run()) == []
+        failed = job.items('failed')
+        assert len(failed) == len(QUERIES)
+        assert all(attempts == 3 for query, attempts, error, updated in failed)
+    # each query has been sent once
+    assert server.stats['search'] == len(QUERIES)
+
+def test_other_errors_retried(tmp_path, engine, server):
+    server.error_code = 20
+    with make_job(tmp_path, engine, max_attempts=3) as job:
+        assert list(job.run()) == []
+        assert job.counts()['failed'] == len(QUERIES)
+        assert job.stats['failed'] == 3 * len(QUERIES)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the request metrics (yxmlmetrics.py) against the local stub server.
+"""
+
+import pytest
+from yxmlengine import Yandexml
+from yxmlproxy import ProxyPool
+from yxmlstub import StubYandexServer
+
+@pytest.fixture(autouse=True)
+def no_proxy_env(monkeypatch):
+    for name in ('NO_PROXY', 'no_proxy', 'HTTP_PROXY', 'http_proxy', 'HTTPS_PROXY', 'https_proxy'):
+        monkeypatch.delenv(name, raising=False)
+
+def connects(engine):
+    return engine.metrics.snapshot()['timings']['search'].get('connect', {}).get('count', 0)
+
+def test_search_phases():
+    with StubYandexServer(groups=5) as server:
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True)
+        for _ in range(3):
+            assert engine.search('query') is not None
+        engine.close()
+    snapshot = engine.metrics.snapshot()
+    assert snapshot['requests']['search'] == 3
+    assert 0 < snapshot['bytes']['search'] < server.stats['bytes_sent'] + 1
+    phases = snapshot['timings']['search']
+    assert {'ttfb', 'download', 'parse', 'build', 'total'} <= set(phases)
+    # the connection is kept alive
+    assert phases['connect']['count'] == 1
+    assert 'yandexml_requests_total{endpoint="search"} 3' in engine.metrics.prometheus()
+
+def test_connect_time_through_proxy():
+    # the proxy stub answers the proxied requests itself
+    with StubYandexServer(groups=5) as server, StubYandexServer(groups=5) as proxy:
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, proxy=proxy.url, reentrant=True)
+        assert engine.search('query') is not None
+        engine.close()
+        assert proxy.stats.get('search') == 1 and not server.stats.get('search')
+    assert connects(engine) == 1
+
+def test_connect_time_through_proxy_pool():
+    with StubYandexServer(groups=5) as server, StubYandexServer(groups=5) as proxy:
+        pool = ProxyPool([{'url': proxy.url, 'ip': '127.0.0.2'}], probe_interval=0)
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, proxy=pool, reentrant=True)
+        assert engine.search('query') is not None
+        engine.close()
+        pool.close()
+        assert proxy.stats.get('search') == 1
+    assert connects(engine) == 1
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the multi-page search (Yandexml.search(pages=N)) against the local stub server.
+"""
+
+import pytest
+from yxmlengine import Yandexml, parse_search_xml
+from yxmlstub import StubYandexServer, make_search_xml
+
+def test_found_groups_parsed():
+    result = parse_search_xml(make_search_xml('query', groups=10, docs_in_group=3, found=750))
+    assert result.found == 750
+    assert result.found_groups == 250
+
+@pytest.mark.parametrize('grouped, docs_in_group, found, expected', [
+    (True, 3, 750, 3),          # 250 groups
+    (True, 1, 150, 2),          # 150 groups
+    (False, None, 250, 3),      # 250 documents
+    (True, 3, 30000, 5),
+])
+def test_pages_requested(grouped, docs_in_group, found, expected):
+    with StubYandexServer(groups=100, docs_in_group=docs_in_group, found=found) as server:
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True)
+        result = engine.search('query', grouped, pages=5)
+        engine.close()
+        assert server.stats['search'] == expected
+    expected_groups = min(500, -(-found // (docs_in_group or 1)))
+    assert len(result.groups) == expected_groups
+    assert result.found_groups == (expected_groups if found < 30000 else 10000)
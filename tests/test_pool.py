@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the account pool (yxmlpool.AccountPool) against the local stub server.
+"""
+
+import time
+import pytest
+from datetime import datetime as dt, timedelta, timezone
+from yxmlengine import Yandexml, QueryTimeout
+from yxmlpool import AccountPool
+from yxmlquota import current_limit
+from yxmlstub import StubYandexServer
+
+def hourly_limits(current, following):
+    # 'ru' mode limits: the current hour and the next one
+    hour = dt.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return {'day': -1, 'hours': [(hour, current), (hour + timedelta(hours=1), following)]}
+
+def test_current_limit():
+    limits = hourly_limits(5, 100)
+    assert current_limit(limits) == 5
+    assert current_limit(limits, time.time() + 3600) == 100
+    assert current_limit(limits, time.time() + 2 * 3600) == -1
+    assert current_limit(limits, time.time() - 3600) == -1
+    assert current_limit({'day': 700, 'hours': []}) == 700
+
+def make_account(server, user, limits):
+    engine = Yandexml(user, 'apikey', 'ru', ip='127.0.0.1', host=server.url, reentrant=True)
+    def query_limits():
+        engine.hour_limits = limits
+        return True
+    engine.query_limits = query_limits
+    return engine
+
+def test_pool_uses_current_hour():
+    with StubYandexServer(groups=2, docs_in_group=1) as server:
+        # 'drained' has few requests left this hour but many in the next one
+        drained = make_account(server, 'drained', hourly_limits(1, 1000))
+        fresh = make_account(server, 'fresh', hourly_limits(50, 10))
+        with AccountPool([drained, fresh]) as pool:
+            for i in range(3):
+                assert pool.search('query {}'.format(i)) is not None
+            usage = {account['account'].split('@')[0]: account for account in pool.usage()}
+    assert usage['fresh']['requests'] == 3
+    assert usage['fresh']['remaining'] == 47
+    assert usage['drained']['requests'] == 0
+
+def test_pool_forwards_deadline():
+    with StubYandexServer(groups=2, docs_in_group=1, latency=1.0) as server:
+        with AccountPool([make_account(server, 'user', hourly_limits(100, 100))]) as pool:
+            started = time.time()
+            with pytest.raises(QueryTimeout):
+                pool._search('slow query', timeout=0.3)
+            assert time.time() - started < 0.9
+            # the engine's query_timeout applies when no timeout is given
+            pool.accounts[0].engine.reset(query_timeout=0.3)
+            results = list(pool.search_many(['slow query 2']))
+            assert isinstance(results[0][1], QueryTimeout)
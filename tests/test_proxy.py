@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the proxy pool (yxmlproxy.ProxyPool): weighting, quarantine and background checks;
+the stub servers act as the proxies (they answer the proxied requests themselves).
+"""
+
+import time
+import random
+import socket
+from collections import Counter
+import pytest
+from yxmlengine import Yandexml
+from yxmlproxy import ProxyPool
+from yxmlstub import StubYandexServer
+
+@pytest.fixture(autouse=True)
+def no_proxy_env(monkeypatch):
+    for name in ('NO_PROXY', 'no_proxy', 'HTTP_PROXY', 'http_proxy', 'HTTPS_PROXY', 'https_proxy'):
+        monkeypatch.delenv(name, raising=False)
+
+@pytest.fixture
+def dead_url():
+    # a local port nobody listens on (connection refused)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return 'http://127.0.0.1:{}'.format(port)
+
+def picks(pool, n=2000):
+    return Counter(pool.acquire().url for _ in range(n))
+
+def test_weighting():
+    random.seed(1)
+    pool = ProxyPool([('http://fast:1', '10.0.0.1'), ('http://slow:1', '10.0.0.2'), ('http://captcha:1', '10.0.0.3')],
+                     probe_interval=0, alpha=1.0)
+    fast, slow, captcha = pool.proxies
+    pool.report(fast, 0.1)
+    pool.report(slow, 0.4)
+    pool.report(captcha, 0.1, captcha=True)
+    counts = picks(pool)
+    # weights: 10 : 2.5 : 0.5 (a proxy only getting captchas keeps the min. weight)
+    assert counts['http://fast:1'] > 3 * counts['http://slow:1'] > 3 * counts['http://captcha:1'] > 0
+    usage = {proxy['url']: proxy for proxy in pool.usage()}
+    assert usage['http://fast:1']['weight'] == pytest.approx(10)
+    assert usage['http://captcha:1']['captchas'] == 1
+    pool.close()
+
+def test_untimed_proxy_gets_best_latency():
+    pool = ProxyPool([('http://timed:1', '10.0.0.1'), ('http://new:1', '10.0.0.2')], probe_interval=0, alpha=1.0)
+    timed, new = pool.proxies
+    pool.report(timed, 0.2)
+    counts = picks(pool)
+    assert abs(counts['http://timed:1'] - counts['http://new:1']) < 300
+    pool.close()
+
+def test_quarantine_and_backoff():
+    pool = ProxyPool([('http://bad:1', '10.0.0.1'), ('http://good:1', '10.0.0.2')],
+                     probe_interval=0, max_failures=2, backoff=0.2, max_backoff=0.3, wait=0)
+    bad, good = pool.proxies
+    pool.report(bad, failed=True)
+    assert not bad.quarantined
+    pool.report(bad, failed=True)
+    assert bad.quarantined and bad.backoff == 0.2
+    # the requests still in flight don't extend the quarantine
+    until = bad.until
+    pool.report(bad, failed=True)
+    assert bad.until == until
+    assert set(picks(pool, 100)) == {'http://good:1'}
+    time.sleep(0.25)
+    # without the checks, the proxy is back when its backoff expires; a repeated failure doubles the backoff (up to the max)
+    assert 'http://bad:1' in picks(pool, 100)
+    pool.report(bad, failed=True)
+    assert bad.quarantined and bad.backoff == 0.3
+    pool.report(bad, 0.1)
+    assert bad.backoff == 0 and bad.failures == 0
+    pool.close()
+
+def test_all_quarantined():
+    pool = ProxyPool([('http://bad:1', '10.0.0.1')], probe_interval=0, max_failures=1, backoff=10, wait=0.2)
+    pool.report(pool.acquire(), failed=True)
+    started = time.time()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    assert 0.2 <= time.time() - started < 2
+    pool.close()
+
+def test_probing(dead_url):
+    with StubYandexServer() as target, StubYandexServer() as live:
+        probe_url = target.url + '/search/xml?action=limits-info'
+        pool = ProxyPool([(live.url, '127.0.0.2'), (dead_url, '127.0.0.3')], probe_urls=[probe_url],
+                         probe_interval=0.2, max_failures=1, backoff=0.1, max_backoff=0.4)
+        good, dead = pool.proxies
+        pool.report(good, failed=True)
+        pool.report(dead, failed=True)
+        assert good.quarantined and dead.quarantined
+        # the prober returns the answering proxy to the pool
+        assert pool.acquire() is good
+        time.sleep(0.6)
+        assert not good.quarantined and good.stats['probes'] >= 2
+        assert dead.quarantined and dead.stats['probes'] >= 2 and dead.backoff == 0.4
+        assert live.stats.get('limits', 0) >= 2 and not target.stats.get('limits')
+        pool.close()
+    assert pool._prober is None
+
+def test_engine_fails_over(dead_url):
+    with StubYandexServer(groups=5) as server, StubYandexServer(groups=5) as live:
+        pool = ProxyPool([(live.url, '127.0.0.2'), (dead_url, '127.0.0.3')], probe_interval=0, max_failures=1, backoff=60, retries=2)
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, proxy=pool, reentrant=True)
+        for _ in range(10):
+            assert engine.search('query') is not None
+        engine.close()
+        pool.close()
+        usage = {proxy['url']: proxy for proxy in pool.usage()}
+        assert live.stats['search'] == 10 and not server.stats.get('search')
+        assert usage[dead_url]['requests'] <= 1 and usage[dead_url]['available_at'] is not None
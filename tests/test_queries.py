@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the bulk query preprocessor (yxmlqueries.QueryPreprocessor) and the request bodies
+(yxmlengine.make_query_body()).
+"""
+
+import xml.etree.ElementTree as ET
+from yxmlengine import Yandexml, make_query_body
+from yxmlqueries import QueryPreprocessor
+from yxmlstub import StubYandexServer
+from globalvars import MAX_QUERY_WORDS, MAX_QUERY_CHARS
+
+SPECIAL = 'cats & dogs <b>"quoted"</b> {0} {}'
+
+def test_body_escaping():
+    body = make_query_body(SPECIAL, True, 2)
+    assert b'&amp;' in body and b'&lt;b&gt;' in body
+    request = ET.fromstring(body)
+    assert request.findtext('query') == SPECIAL
+    assert request.findtext('page') == '2'
+    assert request.find('groupings/groupby').get('attr') == 'd'
+    flat = ET.fromstring(make_query_body(SPECIAL, False, 0))
+    assert flat.findtext('query') == SPECIAL and flat.find('groupings/groupby').get('attr') == ''
+    # memoized
+    assert make_query_body(SPECIAL, True, 2) is body
+
+def test_special_chars_round_trip():
+    with StubYandexServer(groups=3) as server:
+        engine = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True)
+        result = dict(engine.search_many([SPECIAL]))[SPECIAL]
+        engine.close()
+    assert not isinstance(result, Exception)
+    assert result.query == SPECIAL and len(result.groups) == 3
+
+def test_dedupe_and_line_numbers():
+    prep = QueryPreprocessor()
+    lines = ['first query\n', '  first   query \n', 'second\tquery\r\n', 'FIRST query\n', 'second query']
+    prepared = list(prep.process(lines))
+    assert [(q.line, q.query) for q in prepared] == [(1, 'first query'), (3, 'second query'), (4, 'FIRST query')]
+    assert prepared[0].body == make_query_body('first query', True, 0)
+    report = prep.report()
+    assert report['lines'] == 5 and report['accepted'] == 3 and report['duplicates'] == 2
+    # without the de-duplication, and the queries seen are forgotten by reset()
+    assert len(list(QueryPreprocessor(dedupe=False).process(lines))) == 5
+    prep.reset()
+    assert len(list(prep.process(lines[:1]))) == 1
+
+def test_rejections():
+    prep = QueryPreprocessor(grouped=False)
+    lines = ['good', '   \n', b'\xff\xfe bad bytes', 'bell\x07char', 'surrogate \ud800', b'good bytes \xd1\x8f']
+    prepared = list(prep.process(lines, start=10))
+    assert [q.query for q in prepared] == ['good', 'good bytes я']
+    assert ET.fromstring(prepared[0].body).find('groupings/groupby').get('attr') == ''
+    report = prep.report()
+    assert report['rejected'] == 4
+    assert [(n, reason) for n, _, reason in report['rejected_queries']] == [(11, 'empty'), (12, 'encoding'),
+                                                                    (13, 'invalid_chars'), (14, 'invalid_chars')]
+
+def test_truncation():
+    prep = QueryPreprocessor()
+    words = ' '.join('w{}'.format(i) for i in range(MAX_QUERY_WORDS + 5))
+    chars = 'x' * (MAX_QUERY_CHARS + 10)
+    exact = ' '.join(['word'] * MAX_QUERY_WORDS)
+    prepared = list(prep.process([words, chars, exact + '   \n']))
+    assert len(prepared[0].query.split()) == MAX_QUERY_WORDS
+    assert len(prepared[1].query) == MAX_QUERY_CHARS
+    assert prepared[2].query == exact
+    report = prep.report()
+    assert report['truncated'] == 2
+    assert [(n, query) for n, _, query in report['truncated_queries']] == [(1, prepared[0].query), (2, prepared[1].query)]
+
+def test_report_limit():
+    prep = QueryPreprocessor(report_limit=3)
+    list(prep.process([''] * 10))
+    report = prep.report()
+    # all the rejected queries are counted, only the first ones listed
+    assert report['rejected'] == 10 and len(report['rejected_queries']) == 3
+    assert [n for n, _, _ in report['rejected_queries']] == [1, 2, 3]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the request limits scheduler (yxmlquota.QuotaScheduler) with a fake engine.
+"""
+
+import time
+import threading
+from datetime import datetime as dt, timedelta
+import yxmlquota
+from yxmlquota import QuotaScheduler
+
+class FakeEngine:
+    # answers query_limits() with the given daily limit (None = the limits can't be fetched)
+
+    def __init__(self, day=None, delay=0.0):
+        self.day = day
+        self.delay = delay
+        self.calls = 0
+        self.hour_limits = {'day': -1, 'hours': []}
+
+    def query_limits(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.day is None:
+            return None
+        self.hour_limits = {'day': self.day, 'hours': []}
+        return True
+
+def test_failed_limits_let_requests_through(monkeypatch):
+    monkeypatch.setattr(yxmlquota, 'QUOTA_RETRY_DELAY', 0.2)
+    engine = FakeEngine()
+    scheduler = QuotaScheduler(refresh=600, pace=False)
+    started = time.time()
+    assert all(scheduler.acquire(engine, timeout=1) for _ in range(5))
+    assert time.time() - started < 0.5
+    # the update is not retried on every request...
+    assert engine.calls == 1
+    assert scheduler.stats['unthrottled'] == 5
+    assert scheduler.remaining() == -1
+    # ...but soon, not after the whole refresh period
+    engine.day = 2
+    time.sleep(0.25)
+    assert scheduler.acquire(engine, timeout=1)
+    assert engine.calls == 2
+    assert scheduler.remaining() == 1
+    assert scheduler.acquire(engine, timeout=1)
+    assert not scheduler.acquire(engine, timeout=0.1)
+
+def test_limits_fetched_without_the_lock():
+    engine = FakeEngine(day=100, delay=0.5)
+    scheduler = QuotaScheduler(refresh=600, pace=False)
+    fetching = threading.Thread(target=scheduler.acquire, args=(engine,))
+    fetching.start()
+    time.sleep(0.1)
+    started = time.time()
+    assert scheduler.remaining() == -1
+    assert scheduler.next_window() is None
+    assert time.time() - started < 0.1
+    # the other requests wait for the first limits instead of sending another update
+    assert scheduler.acquire(engine, timeout=2)
+    fetching.join()
+    assert engine.calls == 1
+    assert scheduler.remaining() == 98
+
+def test_hourly_limits_windows():
+    engine = FakeEngine()
+    now = dt.now().replace(minute=0, second=0, microsecond=0)
+    def query_limits():
+        engine.hour_limits = {'day': -1, 'hours': [(now, 1), (now + timedelta(hours=1), 5)]}
+        return True
+    engine.query_limits = query_limits
+    scheduler = QuotaScheduler(refresh=600, pace=False)
+    assert scheduler.acquire(engine, timeout=0)
+    assert not scheduler.acquire(engine, timeout=0)
+    assert scheduler.next_window().timestamp() == (now + timedelta(hours=1)).timestamp()
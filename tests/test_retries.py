@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the search retries with backoff, the query deadlines and the hedged requests
+against the local stub server.
+"""
+
+import time
+import threading
+import pytest
+import requests
+import yxmlengine
+from yxmlengine import Yandexml, QueryTimeout
+from yxmlstub import StubYandexServer
+from globalvars import HEDGE_MIN_SAMPLES
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(yxmlengine, 'RETRY_BACKOFF', 0.01)
+
+def make_engine(server, **kwargs):
+    return Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url, reentrant=True, **kwargs)
+
+def run(engine, query='query'):
+    # the result of a query or the exception raised by it
+    return dict(engine.search_many([query]))[query]
+
+def counter(engine, name):
+    return engine.metrics.snapshot().get(name, 0)
+
+## ******************************************************************************** ##
+
+def test_backoff_delays(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(yxmlengine.random, 'uniform', lambda a, b: b)
+    monkeypatch.setattr(yxmlengine.time, 'sleep', sleeps.append)
+    for attempt in range(6):
+        Yandexml._retry_delay(attempt, None)
+    assert sleeps == [0.5, 1, 2, 4, 8, 8]
+    # no waiting past the deadline
+    with pytest.raises(QueryTimeout):
+        Yandexml._retry_delay(3, time.time() + 1)
+    assert len(sleeps) == 6
+
+def test_transient_failures_are_retried(fast_backoff):
+    with StubYandexServer(groups=5, failure_rate=0.5, seed=1) as server:
+        engine = make_engine(server, retries=10)
+        results = [run(engine, 'query {}'.format(i)) for i in range(5)]
+        engine.close()
+    assert all(not isinstance(result, Exception) for result in results)
+    assert server.stats['failures'] > 0
+    assert counter(engine, 'retries') == server.stats['failures']
+    assert server.stats['search'] == 5 + server.stats['failures']
+
+def test_retries_limit(fast_backoff):
+    with StubYandexServer(failure_rate=1.0) as server:
+        engine = make_engine(server, retries=2)
+        result = run(engine)
+        engine.close()
+    assert isinstance(result, requests.HTTPError)
+    assert server.stats['search'] == 3
+    assert counter(engine, 'retries') == 2
+
+def test_deadline_of_slow_request():
+    with StubYandexServer(latency=1.0) as server:
+        engine = make_engine(server, query_timeout=0.3)
+        started = time.time()
+        result = run(engine)
+        elapsed = time.time() - started
+        engine.close()
+    assert isinstance(result, QueryTimeout)
+    assert elapsed < 0.9
+
+def test_deadline_stops_retries(monkeypatch):
+    monkeypatch.setattr(yxmlengine, 'RETRY_BACKOFF', 0.1)
+    with StubYandexServer(failure_rate=1.0) as server:
+        engine = make_engine(server, retries=100, query_timeout=0.5)
+        started = time.time()
+        result = run(engine)
+        elapsed = time.time() - started
+        engine.close()
+    assert isinstance(result, QueryTimeout)
+    assert elapsed < 1
+    assert 1 < server.stats['search'] < 100
+
+## ******************************************************************************** ##
+
+def test_hedged_request_wins():
+    with StubYandexServer(groups=5, latency=1.0) as server:
+        engine = make_engine(server, hedge=0.1)
+        # only the first request is slow: the hedged one, sent after 0.1 sec., answers first
+        timer = threading.Timer(0.05, setattr, (server, 'latency', 0))
+        timer.start()
+        started = time.time()
+        result = run(engine)
+        elapsed = time.time() - started
+        assert not isinstance(result, Exception) and len(result.groups) == 5
+        assert elapsed < 0.8
+        assert counter(engine, 'hedged') == 1 and counter(engine, 'hedge_won') == 1
+        engine.close()
+        timer.join()
+        # both requests have been sent (and answered)
+        deadline = time.time() + 2
+        while server.stats.get('search', 0) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert server.stats['search'] == 2
+
+def test_no_hedge_for_fast_responses():
+    with StubYandexServer(groups=5) as server:
+        engine = make_engine(server, hedge=0.5)
+        for i in range(5):
+            assert not isinstance(run(engine, 'query {}'.format(i)), Exception)
+        engine.close()
+    assert counter(engine, 'hedged') == 0
+    assert server.stats['search'] == 5
+
+def test_adaptive_hedge_delay():
+    with StubYandexServer(groups=1) as server:
+        engine = make_engine(server, hedge=True)
+        for i in range(HEDGE_MIN_SAMPLES - 1):
+            run(engine, 'query {}'.format(i))
+        # too few latencies measured
+        assert engine._hedge_delay() is None
+        run(engine, 'last query')
+        delay = engine._hedge_delay()
+        engine.close()
+    assert delay is not None and 0 < delay <= max(engine._latencies)
+
+def test_hedge_deadline():
+    with StubYandexServer(latency=1.0) as server:
+        engine = make_engine(server, hedge=0.1, query_timeout=0.4)
+        started = time.time()
+        result = run(engine)
+        elapsed = time.time() - started
+        engine.close()
+    assert isinstance(result, QueryTimeout)
+    assert elapsed < 0.9
+    assert counter(engine, 'hedged') == 1
@@ -5,6 +5,8 @@
 This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
 
 This module provides a command-line interface (CLI) for the Yandex XML engine (Yandexml).
+A list of queries can be run without the shell with the 'batch' command:
+	python yxml.py --user <username> --apikey <apikey> batch queries.txt --workers 16 --outfile results.jsonl
 
 See README for a primer on the available commands. Alternatively, run it with: 
 	python yxml.py --username <username> --apikey apikey run
@@ -14,8 +16,14 @@ and then see the help like so:
 
 import webbrowser
 import sys
+import json
+import time
+import collections
+import contextlib
 import fire
-from yxmlengine import Yandexml
+from yxmlengine import Yandexml, YandexXMLRequestError, print_err, print_help
+from yxmlexport import make_writer
+from yxmlqueries import QueryPreprocessor
 from globalvars import *
 
 COMMAND_PROMPT = COLOR_PROMPT + '\nCOMMAND? [w to quit] >'
@@ -37,7 +45,7 @@ class Pyndxml:
         self.engine = Yandexml(user, apikey, mode, ip, proxy, captcha_solver if captcha_solver else Pyndxml.default_captcha_callback)
         self.commands = {'r': self.reset, 'q': self.query, 'l': self.limits_next, 'L': self.limits_all, 
                 'y': self.yandex_logo, 'v': self.view_params, 'h': self.showhelp, 'c': self.sample_captcha, 
-                'o': self.output, 'w': None}
+                'o': self.output, 'b': self.batch, 'w': None}
         self.usage = COLOR_HELP + COLOR_BRIGHT + '\nUSAGE:\t[{}] [value1] [value2] [--param3=value3] [--param4=value4]'.format('|'.join(sorted(self.commands.keys())))
         self.usage2 = COLOR_HELP + '\t' + '\n\t'.join(['{}:{}'.format(fn, self.commands[fn].__doc__) for fn in self.commands if fn != 'w'])
         
@@ -74,6 +82,7 @@ class Pyndxml:
                 if e in self.commands:
                     if self.commands[e] is None: 
                         print(BYE_MSG)
+                        self.engine.close()
                         break
                     cmds = entered.split(' ')
                     fire.Fire(self.commands[e], ' '.join(cmds[1:]) if len(cmds) > 1 else '-')
@@ -83,6 +92,7 @@ class Pyndxml:
                     continue     
             except KeyboardInterrupt:
                 print(BYE_MSG)
+                self.engine.close()
                 break
             
             except Exception:
@@ -104,9 +114,10 @@ class Pyndxml:
         """
         params = ['user', 'apikey', 'mode', 'ip']
         if detail > 1: 
-            params += ['proxy', 'search_cookies', 'search_headers', 'captcha_solver', 
+            params += ['proxy', 'cookies', 'search_headers', 'captcha_solver', 
+                       'pool_connections', 'pool_maxsize', 'pool_block', 'keep_alive', 'retries', 'query_timeout', 'hedge', 'keep_raw', 
                        'query', 'page', 'maxpassages', 'grouped', 'groups_on_page', 'results_in_group', 
-                       'found', 'found_human', 'hour_limits']
+                       'found', 'found_human', 'found_groups', 'hour_limits']
         if detail > 2: 
             params += ['_retry_cnt', 'baseurl', 'limitsurl', '_last_search_query', 'raw_results']
             
@@ -127,26 +138,95 @@ class Pyndxml:
             self.engine.captcha_solver = Pyndxml.default_captcha_callback
         return 'Parameters have been reset'
         
-    def query(self, querystr='', grouped=True, txtformat='txt', outfile=None):
+    def query(self, querystr='', grouped=True, txtformat='txt', outfile=None, pages=1, append=False):
         """
         Search Yandex and output the search results.
         
         PARAMS:
             - querystr [str]: the search query (as you would type into the Yandex searchbar)
             - grouped [bool]: whether the search results will be grouped by domain name (default) or ungrouped
-            - txtformat [str]: one of [txt|json|xml]: the output format for the results
+            - txtformat [str]: one of [txt|json|xml|jsonl|csv]: the output format for the results
                 NOTE: 'txt' will use 'pretty' formatting with human-readable words inserted;
                 'json' will output the results as 'dictionary' (with pretty-printing, i.e. indentations);
                 'xml' will output the raw XML results from Yandex, including some values not retrieved
-                in the other formats
+                in the other formats;
+                'jsonl' and 'csv' will output one line per found document with its query, page and group
+                (a file name ending with '.gz' will be gzipped)
             - outfile [None|str]: path to output file [str] or None to output to console (stdout)
+            - pages [int]: number of results pages to fetch (concurrently, up to MAX_RESULTS results)
+            - append [bool]: append the results to the output file instead of overwriting it
         RETURNS:
             None
         """
-        if self.engine.search(querystr, grouped):
-            self.engine.output_results(txtformat, sys.stdout if outfile is None else outfile)
+        if self.engine.search(querystr, grouped, pages):
+            self.engine.output_results(txtformat, sys.stdout if outfile is None else outfile, append=append)
             
-    def output(self, txtformat='txt', outfile=None):
+    def batch(self, infile='-', workers=POOL_MAXSIZE, outfile=None, txtformat=None, grouped=True, pages=1, append=False,
+              dedupe=True, report=None, header=None):
+        """
+        Run a batch of queries concurrently and stream the found documents to a file or console.
+        
+        PARAMS:
+            - infile [str]: path to a file with one query per line (UTF-8) or '-' to read the queries from stdin
+            - workers [int]: number of concurrent requests
+            - outfile [None|str]: path to output file (a name ending with '.gz' will be gzipped) or None to output to console (stdout)
+            - txtformat [None|str]: one of [jsonl|csv] (None = 'csv' if the output file name contains '.csv', otherwise 'jsonl')
+            - grouped, pages: see "query"
+            - append [bool]: append the results to the output file instead of overwriting it
+            - dedupe [bool]: skip the repeated queries
+            - report [None|str]: path to a JSON file to save the rejected and truncated queries to
+            - header [None|bool]: write the CSV header row (None = unless appending to a non-empty file)
+        RETURNS:
+            None (the failed queries and the summary are printed to stderr)
+        NOTE:
+            stdin and stdout may carry the queries and the results, so the captchas are never entered at the console:
+            without an explicit --captcha_solver the queries that run into the robot check are reported as failed;
+            everything else the engine prints while the batch is running goes to stderr
+        """
+        if txtformat is None:
+            txtformat = 'csv' if outfile and '.csv' in outfile else 'jsonl'
+        if workers > self.engine.pool_maxsize:
+            self.engine.reset(pool_maxsize=workers)
+        prep = QueryPreprocessor(grouped, dedupe)
+        errors = collections.Counter()
+        succeeded = failed = rows = 0
+        started = time.perf_counter()
+        solver = self.engine.captcha_solver
+        if solver is Pyndxml.default_captcha_callback:
+            self.engine.captcha_solver = ''
+        f = sys.stdin.buffer if infile in ('-', None) else open(infile, 'rb')
+        try:
+            options = {'header': header} if txtformat == 'csv' else {}
+            with make_writer(txtformat, sys.stdout if outfile is None else outfile, append=append, **options) as writer, \
+                 contextlib.redirect_stdout(sys.stderr):
+                for query, result in self.engine.search_many((q.query for q in prep.process(f)), grouped, workers, pages):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        errors['ERROR {}'.format(result.errorcode) if isinstance(result, YandexXMLRequestError) else type(result).__name__] += 1
+                        print_err('"{}": {}'.format(query, result))
+                        continue
+                    succeeded += 1
+                    rows += writer.write(result)
+        except KeyboardInterrupt:
+            print_err('Прервано пользователем')
+        finally:
+            self.engine.captcha_solver = solver
+            if f is not sys.stdin.buffer:
+                f.close()
+        elapsed = time.perf_counter() - started
+        
+        stats = prep.stats
+        if report:
+            with open(report, 'w', encoding='utf-8') as fr:
+                json.dump(prep.report(), fr, ensure_ascii=False, indent=4)
+        print_help('\nQUERIES: {} read, {} sent, {} rejected, {} truncated, {} duplicates'.format(
+                stats['lines'], stats['accepted'], stats['rejected'], stats['truncated'], stats['duplicates']), file=sys.stderr)
+        print_help('RESULTS: {} succeeded, {} failed, {} documents written'.format(succeeded, failed, rows), file=sys.stderr)
+        print_help('TIME: {:.1f} sec., {:.1f} queries/sec.'.format(elapsed, (succeeded + failed) / elapsed if elapsed else 0.0), file=sys.stderr)
+        if errors:
+            print_help('ERRORS: ' + ', '.join('{}: {}'.format(k, v) for k, v in errors.most_common()), file=sys.stderr)
+            
+    def output(self, txtformat='txt', outfile=None, append=False):
         """
         Save previous search results to a file or console window.
         
@@ -155,7 +235,7 @@ class Pyndxml:
         RETURNS:
             None
         """
-        self.engine.output_results(txtformat, sys.stdout if outfile is None else outfile) 
+        self.engine.output_results(txtformat, sys.stdout if outfile is None else outfile, append=append)
         
     def limits_next(self):
         """
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements SearchArchive - the append-only archive of raw search responses that can be
+passed to Yandexml / AsyncYandexml ('archive' parameter). Every successful search response is stored
+compressed, so the results can later be re-parsed (e.g. after changing what is extracted from them)
+without spending the request limits again.
+
+The archive consists of two files:
+    - <path>: the zlib-compressed XML responses, one after another
+    - <path>.idx: the index, one JSON line per response: [query, grouped, mode, page, created, offset, size]
+The index is loaded into memory when the archive is opened; a single response is read by seeking
+to its offset, so nothing else is decompressed.
+
+Usage example:
+    archive = SearchArchive('yxml_archive.dat')
+    yxml = Yandexml(user, apikey, 'world', archive=archive)
+    ...
+    for entry, result in archive.reparse(archive.find(mode='world')):
+        ...
+"""
+
+import os
+import json
+import time
+import zlib
+import threading
+from collections import namedtuple
+from yxmlengine import normalize_query, parse_search_xml
+from globalvars import *
+
+## ******************************************************************************** ##
+
+class ArchiveEntry(namedtuple('ArchiveEntry', ['query', 'grouped', 'mode', 'page', 'created', 'offset', 'size'])):
+    """
+    Index entry of an archived response: search parameters, time stored (timestamp)
+    and position of the compressed XML in the data file.
+    """
+    __slots__ = ()
+
+class SearchArchive:
+
+    """
+    Append-only archive of compressed raw search responses with an in-memory index
+    keyed by (normalized query, grouped, mode, page). The archive is thread-safe;
+    it should only be written by one process at a time.
+    """
+
+    def __init__(self, path, level=6):
+        """
+        PARAMS:
+            - path [str]: path to the archive data file (the index is stored next to it with the '.idx' extension)
+            - level [int]: zlib compression level (1-9)
+        """
+        self.path = os.path.expanduser(path)
+        self.index_path = self.path + '.idx'
+        self.level = level
+        self._lock = threading.Lock()
+        self._entries = []
+        self._keys = {}             # search parameters => list of the entries' numbers (oldest first)
+        self._data = open(self.path, 'a+b')
+        self._data.seek(0, os.SEEK_END)
+        complete = self._load_index(self._data.tell())
+        self._index = open(self.index_path, 'a', encoding='utf-8')
+        if not complete:
+            self._index.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            if self._data is None: return
+            self._index.close()
+            self._data.close()
+            self._data = None
+
+    def put(self, query, grouped, mode, page, result_xml, created=None):
+        """
+        Stores a raw search response.
+
+        PARAMS:
+            - query, grouped, mode, page: the search parameters
+            - result_xml [str|bytes]: the response XML
+            - created [float|None]: timestamp of the response (None = now)
+        RETURNS:
+            ArchiveEntry object
+        """
+        if isinstance(result_xml, str):
+            result_xml = result_xml.encode('utf-8')
+        blob = zlib.compress(result_xml, self.level)
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            entry = ArchiveEntry(normalize_query(query), bool(grouped), mode, page,
+                                 time.time() if created is None else created, self._data.tell(), len(blob))
+            # the data goes first, so that the index never points past the end of the data file
+            self._data.write(blob)
+            self._data.flush()
+            self._index.write(json.dumps(list(entry), ensure_ascii=False) + '\n')
+            self._index.flush()
+            self._add_entry(entry)
+        return entry
+
+    def get(self, query, grouped=True, mode='world', page=0, before=None):
+        """
+        Returns the latest archived response XML [str] for the search parameters or None if there is none.
+
+        PARAMS:
+            - before [float|None]: if given, take the latest response stored before this timestamp
+        """
+        with self._lock:
+            numbers = self._keys.get((normalize_query(query), bool(grouped), mode, page), ())
+            entries = [self._entries[n] for n in numbers if before is None or self._entries[n].created < before]
+        return self.read(entries[-1]) if entries else None
+
+    def find(self, query=None, grouped=None, mode=None, page=None, since=None, until=None):
+        """
+        Returns the index entries [list of ArchiveEntry] matching the given search parameters
+        (None = any) and stored within [since, until) (timestamps), oldest first.
+        """
+        if query is not None:
+            query = normalize_query(query)
+        with self._lock:
+            entries = list(self._entries)
+        return [entry for entry in entries
+                if (query is None or entry.query == query) and (grouped is None or entry.grouped == bool(grouped))
+                and (mode is None or entry.mode == mode) and (page is None or entry.page == page)
+                and (since is None or entry.created >= since) and (until is None or entry.created < until)]
+
+    def read(self, entry):
+        """
+        Returns the response XML [str] of an index entry.
+        """
+        with self._lock:
+            self._data.seek(entry.offset)
+            blob = self._data.read(entry.size)
+        return zlib.decompress(blob).decode('utf-8')
+
+    def reparse(self, entries=None, parser=parse_search_xml):
+        """
+        Parses the archived responses again (without any requests).
+
+        PARAMS:
+            - entries [iterable|None]: index entries to parse (None = all, see find())
+            - parser [callable]: function returning the results from the XML text
+                (e.g. a Yandexml engine's parse_results() to load them into the engine)
+        YIELDS:
+            (entry, result) tuples, result being the parser's return value or the exception raised by it
+        """
+        for entry in (self.find() if entries is None else entries):
+            try:
+                yield (entry, parser(self.read(entry)))
+            except Exception as err:
+                yield (entry, err)
+
+    def _add_entry(self, entry):
+        self._keys.setdefault(entry[:4], []).append(len(self._entries))
+        self._entries.append(entry)
+
+    def _load_index(self, data_size):
+        # returns False if the index file ends with an incomplete line
+        if not os.path.exists(self.index_path):
+            return True
+        line = '\n'
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = ArchiveEntry(*json.loads(line))
+                except (ValueError, TypeError):
+                    # a line left incomplete by an interrupted write
+                    continue
+                if entry.offset + entry.size <= data_size:
+                    self._add_entry(entry)
+        return line.endswith('\n')
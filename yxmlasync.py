@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements AsyncYandexml - the asyncio counterpart of the Yandexml engine (see yxmlengine.py).
+It uses the same XML request template and parsers as Yandexml and requires the aiohttp package:
+    pip install aiohttp
+
+Usage example:
+    async with AsyncYandexml(user, apikey, 'world') as yxml:
+        results = await asyncio.gather(*(yxml.search(q) for q in queries))
+"""
+
+import sys, os
+import time
+import asyncio
+import ipaddress
+from yxmlengine import (Yandexml, YandexXMLError, YandexXMLRequestError, CaptchaError, SearchXMLParser, normalize_query, make_query_body, parse_search_xml,
+                        count_pages, count_found_pages, merge_pages, parse_limits_xml, parse_captcha_xml, is_captcha_xml,
+                        parse_ip, read_ip_cache, write_ip_cache, report_error, print_err, print_dbg)
+from yxmlmetrics import Metrics
+from yxmlcookies import CookieStore
+from yxmlproxy import ProxyPool
+from globalvars import *
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+## ******************************************************************************** ##
+
+class AsyncYandexml:
+
+    """
+    Asyncio Yandex.XML engine.
+
+    Unlike Yandexml, the search results are not stored in the engine's properties:
+    search() returns them as a SearchResult object (see yxmlengine.py),
+    so a single engine can run any number of queries concurrently. The number of requests
+    in flight is bounded by 'max_concurrency' ('pool_maxsize' additionally limits the number
+    of connections per host, 0 = no limit).
+    """
+
+    def __init__(self, user, apikey, mode='world', ip='', proxy='', captcha_solver='',
+                 max_concurrency=MAX_CONCURRENT_REQUESTS, pool_maxsize=0, keep_alive=KEEP_ALIVE, cache=None, host='', metrics=None,
+                 archive=None, cookies=None, keep_raw=KEEP_RAW_XML):
+        if aiohttp is None:
+            raise ImportError('AsyncYandexml requires the aiohttp package (pip install aiohttp)')
+        self.session = None
+        self._closed_sessions = []
+        self._semaphore = None
+        self._ip_lock = None
+        self._captcha_lock = None
+        self._captcha_gen = 0
+        self._inflight = {}
+        self.reset(user=user, apikey=apikey, mode=mode, ip=ip, proxy=proxy, captcha_solver=captcha_solver,
+                   max_concurrency=max_concurrency, pool_maxsize=pool_maxsize, keep_alive=keep_alive, cache=cache, host=host, metrics=metrics,
+                   archive=archive, cookies=cookies, keep_raw=keep_raw)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes the HTTP session and all the pooled connections.
+        """
+        for session in self._closed_sessions + [self.session]:
+            if session is not None and not session.closed:
+                await session.close()
+        self._closed_sessions = []
+        self.session = None
+
+    def reset(self, **kwargs):
+        """
+        Sets the engine properties (see Yandexml.reset()).
+        If 'ip' is empty, the host IP will be looked up before the first request.
+        """
+        if not kwargs: return
+        self.__dict__.update({k: kwargs[k] for k in kwargs if k in ('user', 'apikey', 'proxy', 'mode', 'ip', 'captcha_solver',
+                                                                   'max_concurrency', 'pool_maxsize', 'keep_alive', 'cache', 'host', 'metrics', 'archive',
+                                                                   'cookies', 'keep_raw')})
+
+        # request counters and timings (see yxmlmetrics.py)
+        if not isinstance(self.__dict__.get('metrics', None), Metrics):
+            self.metrics = Metrics()
+
+        # robot check cookies (see yxmlcookies.py)
+        if not isinstance(self.__dict__.get('cookies', None), CookieStore):
+            self.cookies = CookieStore()
+
+        # the session will be closed in close() / replaced on next request
+        if any(k in kwargs for k in ('max_concurrency', 'pool_maxsize', 'keep_alive')):
+            self._closed_sessions.append(self.session)
+            self.session = None
+            self._semaphore = None
+
+        # aiohttp accepts a single proxy URL for all schemes
+        if isinstance(self.proxy, ProxyPool):
+            raise YandexXMLError('Пул прокси (ProxyPool) поддерживается только движком Yandexml')
+        if isinstance(self.proxy, dict):
+            self.proxy = self.proxy.get('https', self.proxy.get('http', None))
+        if not isinstance(self.proxy, str) or not self.proxy:
+            self.proxy = None
+
+        if self.mode not in ('world', 'ru'): self.mode = 'world'
+
+        if self.ip and not isinstance(self.ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            self.ip = ipaddress.ip_address(self.ip)
+        elif not self.ip:
+            self.ip = None
+
+        self.search_headers = {}
+        self.make_search_url()
+        self.hour_limits = {'day': -1, 'hours': []}
+
+    make_search_url = Yandexml.make_search_url
+    _cookie_scope = Yandexml._cookie_scope
+    _get_search_cookies = Yandexml._get_search_cookies
+
+    async def search(self, query, grouped=True, pages=1, max_results=None):
+        """
+        Searches Yandex for the query and returns the parsed results.
+
+        PARAMS:
+            - query [str]: the search query
+            - grouped [bool]: whether the results are grouped by domain name
+            - pages, max_results: number of results pages to fetch (see Yandexml.search());
+                the pages after the first one are requested concurrently
+        RETURNS:
+            SearchResult object or None on failure
+        """
+        query = normalize_query(query)
+        first = await self._search(query, grouped)
+        if first is None:
+            return None
+        pages = count_found_pages(first, count_pages(pages, max_results))
+        rest = await asyncio.gather(*(self._search(query, grouped, page) for page in range(1, pages)))
+        if any(result is None for result in rest):
+            return None
+        return merge_pages([first] + rest, max_results)
+
+    async def search_iter(self, query, grouped=True, page=0, info=None):
+        """
+        Streaming search (async generator): parses the response as it is being received.
+
+        PARAMS:
+            - query [str]: the search query
+            - grouped [bool]: whether the results are grouped by domain name
+            - page [int]: results page (0-based)
+            - info [dict|None]: if given, receives the request and 'found' / 'found_human' fields
+        YIELDS:
+            Group object - as soon as it has been received
+        RAISES:
+            Any request / parsing errors (see yxmlengine.iter_search_xml())
+        """
+        query_body = make_query_body(normalize_query(query), grouped, page)
+        for _ in range(MAX_CAPTCHA_ROUNDS + 1):
+            captcha_gen = self._captcha_gen
+            parser = SearchXMLParser(info)
+            received = [] if self.archive is not None else None
+            headers = await self._get_search_headers()
+            try:
+                with self.metrics.call('search') as call:
+                    async with self._semaphore:
+                        session = await self._get_session()
+                        start = time.perf_counter()
+                        async with session.post(self.baseurl, data=query_body, headers=headers, proxy=self.proxy,
+                                                cookies=self._get_search_cookies(self.baseurl)) as response:
+                            call.status = response.status
+                            call.add_time('ttfb', time.perf_counter() - start)
+                            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                                call.bytes += len(chunk)
+                                if received is not None:
+                                    received.append(chunk)
+                                for group in parser.feed(chunk):
+                                    yield group
+                    for group in parser.close():
+                        yield group
+                if received is not None:
+                    self.archive.put(query, grouped, self.mode, page, b''.join(received))
+                return
+            except YandexXMLRequestError as err:
+                if err.errorcode != 100: raise
+                captcha_xml = err.context
+            self.metrics.count('retries')
+            if not await self._pass_captcha(captcha_xml, captcha_gen):
+                raise CaptchaError('Не удалось пройти проверку на робота (капча)', captcha_xml)
+        raise CaptchaError('Превышено число повторов запроса после ввода капчи')
+
+    async def _search(self, query, grouped=True, page=0):
+        # identical concurrent queries are coalesced: the first one is sent, the others share its result
+        if self.cache is not None:
+            result = self.cache.get(self.cache.make_key(query, grouped, self.mode, page))
+            if result is not None:
+                return result
+        key = (query, bool(grouped), self.mode, page)
+        future = self._inflight.get(key)
+        while future is not None:
+            try:
+                result = await asyncio.shield(future)
+                self.metrics.count('coalesced')
+                return result
+            except asyncio.CancelledError:
+                # re-raise if it is this task that has been cancelled, not the one sending the request
+                if not future.cancelled(): raise
+            future = self._inflight.get(key)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._search_request(query, grouped, page)
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+            if not future.done():
+                future.cancel()
+
+    async def _search_request(self, query, grouped=True, page=0):
+        query_body = make_query_body(query, grouped, page)
+
+        def parse(result_xml):
+            result = parse_search_xml(result_xml, self.keep_raw)
+            if self.archive is not None:
+                self.archive.put(query, grouped, self.mode, page, result_xml)
+            if self.cache is not None:
+                self.cache.put(self.cache.make_key(query, grouped, self.mode, page), result, result_xml)
+            return result
+
+        for _ in range(MAX_CAPTCHA_ROUNDS + 1):
+            captcha_gen = self._captcha_gen
+            try:
+                result = await self._request('POST', self.baseurl, 'search', parse,
+                                             data=query_body, headers=await self._get_search_headers(),
+                                             cookies=self._get_search_cookies(self.baseurl))
+                return result
+
+            except YandexXMLError as err:
+                if getattr(err, 'errorcode', 0) != 100:
+                    report_error(err, self.mode)
+                    return None
+                # защита от робота: решаем капчу и повторяем запрос
+                self.metrics.count('retries')
+                if not await self._pass_captcha(err.context, captcha_gen):
+                    return None
+
+            except Exception as err:
+                report_error(err, self.mode)
+                return None
+
+        print_err('Превышено число повторов запроса после ввода капчи')
+        return None
+
+    async def query_limits(self):
+        """
+        Requests the Yandex.XML limits for the next day (by hours for the 'ru' mode).
+        https://tech.yandex.ru/xml/doc/dg/concepts/limits-docpage/
+
+        RETURNS:
+            [dict] hour_limits (also stored in the engine's 'hour_limits' property) or None on failure
+        """
+        try:
+            self.hour_limits = await self._request('GET', self.limitsurl, 'limits', lambda result_xml: parse_limits_xml(result_xml, self.mode))
+            return self.hour_limits
+
+        except Exception as err:
+            report_error(err, self.mode)
+            return None
+
+    async def process_captcha(self, result_xml, retries=-1):
+        """
+        Solves the captcha from a robot check response (error 100) with the engine's captcha_solver
+        and sends the answer to Yandex. The resulting 'spravka' cookie is kept in the engine's
+        cookie store (see yxmlcookies.py) for all subsequent requests.
+
+        PARAMS:
+            - result_xml [str]: Yandex XML response containing the captcha
+            - retries [int]: max number of captchas to solve (0 or negative = unlimited, as in Yandexml._check_captcha())
+        RETURNS:
+            True on success and False on failure
+        """
+        if not self.captcha_solver:
+            print_err('Не задан обработчик капчи (captcha_solver)')
+            return False
+
+        retry_cnt = 0
+        try:
+            while True:
+                captcha_url, captcha_key = parse_captcha_xml(result_xml)
+                result = await self._solve_captcha(captcha_url)
+                if not result: raise CaptchaError('Ошибка распознания капчи', captcha_url)
+
+                result_xml = await self._request('GET', self.yandex_url + '/xcheckcaptcha', 'captcha', store_cookies=True,
+                                                 params={'key': captcha_key, 'rep': result}, headers=await self._get_search_headers(),
+                                                 cookies=self._get_search_cookies(self.yandex_url + '/xcheckcaptcha'))
+                if not is_captcha_xml(result_xml):
+                    return True
+
+                # новая капча (предыдущая была неверно распознана)
+                retry_cnt += 1
+                if retries > 0 and retry_cnt >= retries:
+                    raise CaptchaError('Достигнут лимит попыток ввода капчи')
+                print_err('Неверно отгадана капча{}'.format('' if retries <= 0 else ', осталось {} попыток'.format(retries - retry_cnt)))
+
+        except Exception as err:
+            report_error(err, self.mode)
+            return False
+
+    async def solve_sample_captcha(self, retries=3):
+        """
+        Requests a sample captcha from Yandex XML and tries to solve it with the engine's captcha_solver.
+        """
+        try:
+            result_xml = await self._request('GET', self.yandex_url + '/search/xml', 'sample_captcha',
+                                             params={'query': SAMPLE_CAPTCHA_QUERY, 'user': self.user, 'key': self.apikey, 'showmecaptcha': 'yes'},
+                                             headers=await self._get_search_headers())
+        except Exception as err:
+            print_err(str(err))
+            return False
+        if await self.process_captcha(result_xml, retries):
+            print('КАПЧА РАСПОЗНАНА!')
+            return True
+        return False
+
+    async def _pass_captcha(self, result_xml, captcha_gen):
+        # only one captcha is solved at a time; the queries that ran into the robot check
+        # while it was being solved are simply resent afterwards
+        async with self._captcha_lock:
+            if captcha_gen != self._captcha_gen:
+                return True
+            try:
+                if not await asyncio.wait_for(self.process_captcha(result_xml, CAPTCHA_RETRIES), CAPTCHA_TIMEOUT or None):
+                    return False
+            except asyncio.TimeoutError:
+                print_err('Превышено время ожидания решения капчи')
+                return False
+            self._captcha_gen += 1
+            return True
+
+    async def _get_session(self):
+        for session in self._closed_sessions:
+            if session is not None and not session.closed:
+                await session.close()
+        self._closed_sessions = []
+
+        if self.session is None or self.session.closed:
+            headers = dict(REQ_HEADERS)
+            if not self.keep_alive:
+                headers['Connection'] = 'close'
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.pool_maxsize,
+                                             force_close=not self.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector, headers=headers,
+                                                 timeout=aiohttp.ClientTimeout(total=REQ_TIMEOUT))
+        return self.session
+
+    def _init_primitives(self):
+        # asyncio primitives are created on first use so that they belong to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._ip_lock = asyncio.Lock()
+            self._captcha_lock = asyncio.Lock()
+
+    async def _request(self, method, url, endpoint='other', parse=None, store_cookies=False, **kwargs):
+        # returns the response text or, if 'parse' is given, parse(body) - the (decompressed) body bytes being passed as they are;
+        # the call is recorded in the metrics under 'endpoint';
+        # with 'store_cookies', the response cookies are kept in the cookie store
+        self._init_primitives()
+        with self.metrics.call(endpoint) as call:
+            async with self._semaphore:
+                session = await self._get_session()
+                start = time.perf_counter()
+                async with session.request(method, url, proxy=self.proxy, **kwargs) as response:
+                    call.status = response.status
+                    call.add_time('ttfb', time.perf_counter() - start)
+                    start = time.perf_counter()
+                    data = await response.read()
+                    call.add_time('download', time.perf_counter() - start)
+                    # bytes as transferred (compressed), if the aiohttp version counts them
+                    call.bytes = getattr(response.content, 'total_raw_bytes', len(data))
+                    if parse is None:
+                        data = data.decode(response.get_encoding())
+                    if store_cookies:
+                        self.cookies.update(self._cookie_scope(), response.cookies.values(), str(response.url))
+            return parse(data) if parse else data
+
+    async def _get_search_headers(self):
+        self._init_primitives()
+        if self.ip is None:
+            async with self._ip_lock:
+                if self.ip is None:
+                    ip = await self._get_ip()
+                    if not ip:
+                        raise YandexXMLError('Невозможно определить IP хоста (задайте параметр "ip")')
+                    self.ip = ipaddress.ip_address(ip)
+        headers = dict(self.search_headers)
+        headers['X-Real-Ip'] = str(self.ip)
+        return headers
+
+    async def _get_ip(self):
+        """
+        Вернуть текущий внешний IP хоста.
+        The IP services are queried concurrently, the first valid answer is taken and cached in IP_CACHE_FILE.
+        """
+        ip = read_ip_cache(self.proxy)
+        if ip: return ip
+        tasks = [asyncio.ensure_future(self._request('GET', service, 'ip')) for service in IPSERVICES]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    ip = parse_ip(await next_done)
+                except Exception:
+                    continue
+                if ip is not None:
+                    write_ip_cache(ip, self.proxy)
+                    return str(ip)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return ''
+
+    async def _solve_captcha(self, img_url):
+        if asyncio.iscoroutinefunction(self.captcha_solver):
+            return str(await self.captcha_solver(img_url))
+
+        if callable(self.captcha_solver):
+            # blocking callback (e.g. console input) is run in the default executor
+            return str(await asyncio.get_running_loop().run_in_executor(None, self.captcha_solver, img_url))
+
+        if isinstance(self.captcha_solver, str):
+            # path to external py / exe
+            if os.path.isfile(self.captcha_solver):
+                params = [self.captcha_solver, img_url]
+                if self.captcha_solver.lower().endswith('.py'):
+                    params.insert(0, sys.executable)
+                proc = await asyncio.create_subprocess_exec(*params, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                out, err = await proc.communicate()
+                if not proc.returncode: return out.decode('utf-8')
+                raise YandexXMLError(err.decode('utf-8'), self.captcha_solver)
+            raise NotImplementedError('captcha_solver должна быть путем к файлу *.exe или *.py')
+
+        raise YandexXMLError('Некорректный тип решателя капчи (captcha_solver)!', type(self.captcha_solver).__name__)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements SearchCache - the search results cache that can be passed to 
+Yandexml / AsyncYandexml ('cache' parameter) to avoid spending the request limits on repeated queries.
+
+Usage example:
+    cache = SearchCache('~/yxml_cache.db', ttl=3600)
+    yxml = Yandexml(user, apikey, 'world', cache=cache)
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from yxmlengine import normalize_query, parse_search_xml
+from globalvars import *
+
+## ******************************************************************************** ##
+
+class SearchCache:
+
+    """
+    Two-tier (memory + disk) cache of search results keyed by (normalized query, grouped, mode, page).
+
+    The memory tier keeps up to 'max_items' SearchResult objects in LRU order. The disk tier (optional)
+    is an SQLite database with the compressed raw XML of up to 'max_disk_items' results (least recently 
+    used ones are evicted first); its results are parsed back with parse_search_xml(). 
+    The cache is thread-safe and can be shared by several engines.
+    """
+
+    def __init__(self, path=None, ttl=CACHE_TTL, max_items=CACHE_MAX_ITEMS, max_disk_items=CACHE_MAX_DISK_ITEMS):
+        """
+        PARAMS:
+            - path [str|None]: path to the cache database file (None = memory only)
+            - ttl [int]: time-to-live of cached results (sec.), 0 = never expire
+            - max_items [int]: max number of results kept in memory
+            - max_disk_items [int]: max number of results kept in the database
+        """
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_disk_items = max_disk_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(os.path.expanduser(path), check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, created REAL, accessed REAL, xml BLOB)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            self.db.commit()
+            self._disk_items = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    @staticmethod
+    def make_key(query, grouped=True, mode='world', page=0):
+        """
+        Returns the cache key [str] for the search parameters.
+        """
+        return json.dumps([normalize_query(query), bool(grouped), mode, page], ensure_ascii=False)
+
+    def get(self, key):
+        """
+        Returns the cached SearchResult object or None if there is no (fresh) result for the key.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if self._is_fresh(item[0], now):
+                    self._items.move_to_end(key)
+                    self.stats['hits'] += 1
+                    self.stats['memory_hits'] += 1
+                    return item[1]
+                del self._items[key]
+
+            if self.db is not None:
+                row = self.db.execute('SELECT created, xml FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None and self._is_fresh(row[0], now):
+                    self.db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+                    self.db.commit()
+                    result = parse_search_xml(zlib.decompress(row[1]))
+                    self._put_memory(key, row[0], result)
+                    self.stats['hits'] += 1
+                    self.stats['disk_hits'] += 1
+                    return result
+
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, result, xml=None):
+        """
+        Stores a SearchResult object in the cache.
+        'xml' [bytes|str|None] is the XML stored on disk if the result doesn't keep it (None = result.raw_results).
+        """
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now, result)
+            if self.db is None:
+                return
+            if xml is None:
+                xml = result.raw_results
+            if not xml:
+                return
+            if not isinstance(xml, bytes):
+                xml = xml.encode('utf-8')
+            exists = self.db.execute('SELECT 1 FROM results WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, now, now, zlib.compress(xml)))
+            if not exists:
+                self._disk_items += 1
+            if self._disk_items > self.max_disk_items:
+                evicted = self.db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed LIMIT ?)', 
+                                          (self._disk_items - self.max_disk_items,)).rowcount
+                self._disk_items -= evicted
+                self.stats['evictions'] += evicted
+            self.db.commit()
+
+    def clear(self, expired_only=False):
+        """
+        Removes all (or only the expired) results from the cache.
+        """
+        now = time.time()
+        with self._lock:
+            if expired_only:
+                for key in [k for k, item in self._items.items() if not self._is_fresh(item[0], now)]:
+                    del self._items[key]
+            else:
+                self._items.clear()
+            if self.db is not None:
+                if not expired_only:
+                    self.db.execute('DELETE FROM results')
+                elif self.ttl > 0:
+                    self.db.execute('DELETE FROM results WHERE created < ?', (now - self.ttl,))
+                self.db.commit()
+                self._disk_items = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def _put_memory(self, key, created, result):
+        self._items[key] = (created, result)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _is_fresh(self, created, now):
+        return self.ttl <= 0 or now - created < self.ttl
+
+    def reset_stats(self):
+        self.stats = {'hits': 0, 'misses': 0, 'memory_hits': 0, 'disk_hits': 0, 'evictions': 0}
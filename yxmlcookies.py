@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements CookieStore - the store of the cookies received after a solved captcha
+(the 'spravka' cookie that lets the following requests pass the robot check). It can be passed
+to Yandexml / AsyncYandexml ('cookies' parameter) and shared by all the engines working with
+the same account and IP, in one or several processes: with a file path, the cookies are kept
+in a JSON file, so they also survive restarts.
+
+Usage example:
+    cookies = CookieStore('~/yxml_cookies.json')
+    yxml1 = Yandexml(user, apikey, 'world', cookies=cookies)
+    yxml2 = Yandexml(user, apikey, 'world', cookies=cookies)
+"""
+
+import os
+import json
+import time
+import threading
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from globalvars import *
+
+## ******************************************************************************** ##
+
+class _FileLock:
+
+    # inter-process lock: a lock file created exclusively (works on any OS);
+    # a lock file older than 'stale' seconds is considered left by a crashed process
+
+    def __init__(self, path, timeout=10, stale=30):
+        self.path = path
+        self.timeout = timeout
+        self.stale = stale
+
+    def __enter__(self):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale:
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue
+            if time.time() > deadline:
+                raise TimeoutError('Невозможно заблокировать файл {}'.format(self.path))
+            time.sleep(0.01)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+## ******************************************************************************** ##
+
+class CookieStore:
+
+    """
+    Thread- and process-safe cookie jar with separate scopes (one per account and IP, see Yandexml).
+
+    The cookies are matched to the request URLs by domain (a cookie set for yandex.com is not sent
+    to yandex.ru; a cookie without the Domain attribute is only sent to the host that set it)
+    and path; the expired cookies are evicted. With a file path, the store is reloaded whenever
+    the file has been changed by another process.
+    """
+
+    def __init__(self, path=None):
+        """
+        PARAMS:
+            - path [str|None]: path to the cookies file (None = memory only)
+        """
+        self.path = os.path.expanduser(path) if path else None
+        self._lock = threading.Lock()
+        self._scopes = {}           # scope => {(domain, path, name): cookie [dict]}
+        self._mtime = None
+
+    def get(self, scope, url):
+        """
+        Returns the cookies to send with a request [dict: name => value].
+
+        PARAMS:
+            - scope [str]: the engine's scope (account and IP)
+            - url [str]: the request URL
+        """
+        parts = urlsplit(url)
+        host, path = (parts.hostname or '').lower(), parts.path or '/'
+        now = time.time()
+        with self._lock:
+            self._reload()
+            return {cookie['name']: cookie['value'] for cookie in self._scopes.get(scope, {}).values()
+                    if self._matches(cookie, host, path) and (cookie['expires'] is None or cookie['expires'] > now)}
+
+    def update(self, scope, cookies, url):
+        """
+        Stores the cookies received in a response.
+
+        PARAMS:
+            - scope [str]: the engine's scope (account and IP)
+            - cookies [iterable]: http.cookiejar.Cookie objects (e.g. a requests cookie jar)
+                or http.cookies.Morsel objects (e.g. aiohttp response.cookies.values())
+            - url [str]: the URL of the response
+        """
+        host = (urlsplit(url).hostname or '').lower()
+        cookies = [self._make_cookie(cookie, host) for cookie in cookies]
+        if not cookies: return
+        with self._lock:
+            if self.path is None:
+                self._merge(scope, cookies)
+                return
+            with _FileLock(self.path + '.lock'):
+                self._reload(True)
+                self._merge(scope, cookies)
+                self._save()
+
+    def clear(self, scope=None):
+        """
+        Deletes the cookies of a scope (None = all).
+        """
+        with self._lock:
+            if self.path is None:
+                self._clear(scope)
+                return
+            with _FileLock(self.path + '.lock'):
+                self._reload(True)
+                self._clear(scope)
+                self._save()
+
+    def _clear(self, scope):
+        if scope is None:
+            self._scopes = {}
+        else:
+            self._scopes.pop(scope, None)
+
+    def _merge(self, scope, cookies):
+        now = time.time()
+        jar = self._scopes.setdefault(scope, {})
+        for cookie in cookies:
+            key = (cookie['domain'], cookie['path'], cookie['name'])
+            if cookie['expires'] is not None and cookie['expires'] <= now:
+                # the server deletes the cookie
+                jar.pop(key, None)
+            else:
+                jar[key] = cookie
+        self._evict(now)
+
+    def _evict(self, now):
+        for scope in list(self._scopes):
+            jar = self._scopes[scope]
+            for key in [key for key, cookie in jar.items() if cookie['expires'] is not None and cookie['expires'] <= now]:
+                del jar[key]
+            if not jar:
+                del self._scopes[scope]
+
+    def _reload(self, force=False):
+        if self.path is None: return
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        mtime = (stat.st_mtime_ns, stat.st_size)
+        if not force and mtime == self._mtime: return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._mtime = mtime
+        self._scopes = {scope: {(cookie['domain'], cookie['path'], cookie['name']): cookie for cookie in cookies}
+                        for scope, cookies in data.items()}
+        self._evict(time.time())
+
+    def _save(self):
+        # written to a temporary file and renamed, so that the readers never see a partial file
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({scope: list(jar.values()) for scope, jar in self._scopes.items()}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        stat = os.stat(self.path)
+        self._mtime = (stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def _matches(cookie, host, path):
+        domain = cookie['domain']
+        if cookie['host_only']:
+            if host != domain: return False
+        elif host != domain and not host.endswith('.' + domain):
+            return False
+        return path.startswith(cookie['path'])
+
+    @staticmethod
+    def _make_cookie(cookie, host):
+        # converts a cookiejar Cookie or a Morsel to a plain dict
+        if hasattr(cookie, 'domain_specified'):
+            domain, path, expires = cookie.domain, cookie.path, cookie.expires
+            host_only = not cookie.domain_specified
+            name, value = cookie.name, cookie.value
+        else:
+            domain, path = cookie['domain'], cookie['path']
+            host_only = not domain
+            name, value = cookie.key, cookie.value
+            expires = None
+            if cookie['max-age']:
+                expires = time.time() + int(cookie['max-age'])
+            elif cookie['expires']:
+                expires = parsedate_to_datetime(cookie['expires']).timestamp()
+        domain = (domain or host).lstrip('.').lower()
+        return {'name': name, 'value': value, 'domain': domain, 'path': path or '/', 'host_only': host_only,
+                'expires': None if expires is None else float(expires)}
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements the streaming results writers: JsonLinesWriter (one JSON object per line)
+and CsvWriter. Each found document is written as a flat row with its query / page / group context,
+the rows are appended to the output file as the results arrive, and a file ending with '.gz' is gzipped.
+
+Usage example:
+    with JsonLinesWriter('results.jsonl.gz') as writer:
+        writer.write_many(yxml.search_many(queries))
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import gzip
+from globalvars import *
+
+# columns of the output rows (in this order)
+EXPORT_FIELDS = ('query', 'page', 'found', 'group', 'group_count', 'position', 'url', 'domain', 'title', 'headline',
+                 'modified', 'passages', 'size', 'type', 'charset', 'language', 'saved_copy')
+
+## ******************************************************************************** ##
+
+def iso_modtime(modtime):
+    """
+    Converts a Yandex timestamp ('20190218T102350') to ISO 8601 ('2019-02-18T10:23:50'), '' stays ''.
+    """
+    if len(modtime) != 15:
+        return modtime
+    return '{}-{}-{}T{}:{}:{}'.format(modtime[:4], modtime[4:6], modtime[6:8], modtime[9:11], modtime[11:13], modtime[13:])
+
+def iter_rows(result):
+    """
+    Yields the documents of a search result as tuples of EXPORT_FIELDS values.
+
+    PARAMS:
+        - result [SearchResult|Yandexml]: search results
+    """
+    query, page, found = result.query, result.page, result.found
+    position = page * result.groups_on_page if result.groups_on_page else 0
+    for group in result.groups:
+        position += 1
+        for doc in group.docs:
+            yield (query, page, found, group.name, group.count, position, doc.url, doc.domain, doc.title, doc.headline,
+                   iso_modtime(doc.modtime), doc.passages, doc.size, doc.type, doc.charset, doc.language, doc.saved_copy)
+
+## ******************************************************************************** ##
+
+class ResultWriter:
+
+    """
+    Base class of the streaming writers. The output file is opened once (for appending by default)
+    with a large write buffer; a path ending with '.gz' (or compress=True) is written with gzip
+    (appending to a gzipped file adds a new gzip member, which gzip readers handle transparently).
+    """
+
+    def __init__(self, out=sys.stdout, append=True, compress=None, buffer_size=EXPORT_BUFFER_SIZE):
+        """
+        PARAMS:
+            - out [str|file]: output file path or text file-like object (not closed by the writer)
+            - append [bool]: append to an existing file (False = overwrite)
+            - compress [bool|None]: gzip the output (None = if the path ends with '.gz')
+            - buffer_size [int]: write buffer (bytes)
+        """
+        self.rows = 0
+        self.results = 0
+        self.errors = 0
+        self._own = isinstance(out, str)
+        if not self._own:
+            self._file = out
+            # a stream is new unless it is a file already written to (e.g. stdout redirected with '>>')
+            try:
+                self._empty = not out.seekable() or out.tell() == 0
+            except (AttributeError, OSError, ValueError):
+                self._empty = True
+            return
+        if compress is None:
+            compress = out.endswith('.gz')
+        mode = 'ab' if append else 'wb'
+        self._empty = not append or not os.path.exists(out) or not os.path.getsize(out)
+        raw = io.BufferedWriter(gzip.GzipFile(out, mode), buffer_size) if compress else open(out, mode, buffering=buffer_size)
+        self._file = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, result):
+        """
+        Writes the documents of a search result.
+
+        PARAMS:
+            - result [SearchResult|Yandexml]: search results (None = nothing to write)
+        RETURNS:
+            number of rows written [int]
+        """
+        if result is None or not result.groups:
+            return 0
+        n = self._write_rows(iter_rows(result))
+        self.rows += n
+        self.results += 1
+        return n
+
+    def write_many(self, results):
+        """
+        Writes the results as they arrive, e.g. from Yandexml.search_many().
+
+        PARAMS:
+            - results [iterable]: (query, result) tuples or results; errors (exceptions) are counted and skipped
+        RETURNS:
+            number of rows written [int]
+        """
+        n = 0
+        for result in results:
+            if isinstance(result, tuple) and len(result) == 2:
+                result = result[1]
+            if isinstance(result, Exception):
+                self.errors += 1
+                continue
+            n += self.write(result)
+        return n
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is None: return
+        if self._own:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+
+    def _write_rows(self, rows):
+        raise NotImplementedError
+
+## ******************************************************************************** ##
+
+class JsonLinesWriter(ResultWriter):
+
+    """
+    Writes each document as a JSON object (EXPORT_FIELDS keys, 'passages' being a list) on its own line.
+    """
+
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def _write_rows(self, rows):
+        encode = self._encoder.encode
+        lines = [encode(dict(zip(EXPORT_FIELDS, row))) for row in rows]
+        if lines:
+            self._file.write('\n'.join(lines) + '\n')
+        return len(lines)
+
+class CsvWriter(ResultWriter):
+
+    """
+    Writes each document as a CSV row (EXPORT_FIELDS columns, the passages being joined with newlines);
+    the header row is written to a new (empty) file or stream only (e.g. stdout, but not a file appended to).
+    """
+
+    def __init__(self, out=sys.stdout, append=True, compress=None, buffer_size=EXPORT_BUFFER_SIZE, header=None):
+        """
+        PARAMS:
+            See ResultWriter.
+            - header [bool|None]: write the header row (None = only to a new file or stream)
+        """
+        super().__init__(out, append, compress, buffer_size)
+        self._writer = csv.writer(self._file)
+        if header or (header is None and self._empty):
+            self._writer.writerow(EXPORT_FIELDS)
+
+    def _write_rows(self, rows):
+        n = 0
+        writerow = self._writer.writerow
+        for row in rows:
+            writerow(row[:11] + ('\n'.join(row[11]),) + row[12:])
+            n += 1
+        return n
+
+## ******************************************************************************** ##
+
+WRITERS = {'jsonl': JsonLinesWriter, 'csv': CsvWriter}
+
+def make_writer(txtformat, out=sys.stdout, **kwargs):
+    """
+    Creates a streaming writer.
+
+    PARAMS:
+        - txtformat [str]: one of [jsonl|csv]
+        - out, kwargs: see ResultWriter
+    RETURNS:
+        JsonLinesWriter or CsvWriter
+    RAISES:
+        ValueError on unknown format
+    """
+    if txtformat not in WRITERS:
+        raise ValueError('Unknown export format: "{}" (use one of: {})'.format(txtformat, '|'.join(WRITERS)))
+    return WRITERS[txtformat](out, **kwargs)
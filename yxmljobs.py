@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements CrawlJob - a resumable run of a large query set (that may take days
+because of the request limits) on a Yandexml engine. The state of each query is kept in
+a journal (SQLite database), so a job interrupted by a crash, Ctrl-C or the limits picks up
+where it stopped: the queries done are never sent again, the failed ones are retried,
+on error 32 (limits exceeded) the job sleeps until the next limits interval
+and on error 55 (too many requests per second) it backs off for a while.
+
+Query states:
+    - pending: not run yet (or interrupted / stopped by the limits)
+    - done: the results have been received and handed over
+    - failed: the last run failed (retried up to 'max_attempts' times)
+    - captcha: the last run was blocked by the robot check (retried like the failed ones)
+
+Usage example:
+    with CrawlJob('crawl.db', Yandexml(user, apikey, 'ru')) as job, JsonLinesWriter('results.jsonl.gz') as writer:
+        job.add(open('queries.txt', encoding='utf-8'))
+        for query, result in job.run():
+            writer.write(result)
+            writer.flush()
+        print(job.counts())
+"""
+
+import os
+import time
+import sqlite3
+import itertools
+import threading
+from datetime import datetime as dt
+from yxmlengine import YandexXMLRequestError, CaptchaError, print_dbg
+from yxmlqueries import QueryPreprocessor
+from yxmlquota import next_window
+from globalvars import *
+
+JOB_STATES = ('pending', 'done', 'failed', 'captcha')
+
+## ******************************************************************************** ##
+
+class CrawlJob:
+
+    """
+    Runs the queries of a journal on an engine (see Yandexml.search_many()) and records the outcome
+    of each one as it arrives. run() yields the results: a query is marked done when the next one
+    is requested, so a result is never lost (if the job is interrupted before that, the query is
+    simply run again). Queries are run in the order they were added.
+
+    Errors:
+        - 32 (limits exceeded): the query goes back to pending and no more queries are sent;
+            after the running ones have completed, the job sleeps until the next limits interval
+            (see yxmlquota.next_window()) and goes on
+        - 55 (requests per second limit exceeded): same as 32, but the job only sleeps for JOB_RATE_WAIT seconds
+        - JOB_FATAL_ERRORS (account / key / IP not accepted): the query goes back to pending
+            and run() raises the error after the running queries have completed
+        - JOB_PERMANENT_ERRORS (e.g. 15 - nothing found, query syntax errors): the query is marked failed
+            and not run again (see retry_failed())
+        - robot check not passed (CaptchaError) / other errors (including the other Yandex errors):
+            the query is marked captcha / failed and run again (after 'retry_delay' seconds) up to 'max_attempts' times
+    """
+
+    def __init__(self, path, engine, grouped=True, pages=1, max_results=None, max_workers=POOL_MAXSIZE,
+                 max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY):
+        """
+        PARAMS:
+            - path [str]: path to the journal database file (created if it doesn't exist)
+            - engine [Yandexml]: the engine running the queries
+            - grouped, pages, max_results: see Yandexml.search()
+            - max_workers [int]: number of concurrent requests (see Yandexml.search_many())
+            - max_attempts [int]: max number of times a failed or captcha-blocked query is run
+            - retry_delay [float]: pause (sec.) before the failed queries are run again
+        """
+        self.engine = engine
+        self.grouped = grouped
+        self.pages = pages
+        self.max_results = max_results
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stats = {'done': 0, 'failed': 0, 'captcha': 0, 'limits_waits': 0, 'rate_waits': 0, 'waited': 0.0}
+        self._stop = threading.Event()
+        self._paused = None         # why no more queries are sent in this round: None | 'limits' | 'rate' | 'fatal'
+        self.db = sqlite3.connect(os.path.expanduser(path), check_same_thread=False)
+        # the journal is written after each query: WAL keeps the commits cheap
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS queries (id INTEGER PRIMARY KEY, query TEXT UNIQUE, state TEXT, '
+                        'attempts INTEGER, error TEXT, updated REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS queries_state ON queries (state, id)')
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the journal.
+        """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def add(self, queries):
+        """
+        Adds queries to the journal (see yxmlqueries.QueryPreprocessor); the ones already there are skipped.
+
+        PARAMS:
+            - queries [iterable]: search queries [str|bytes] (e.g. an open file, may be a generator)
+        RETURNS:
+            the preprocessing report [dict] (see QueryPreprocessor.report()) with the number of queries 'added'
+        """
+        prep = QueryPreprocessor(self.grouped, dedupe=False)
+        prepared = prep.process(queries)
+        added = 0
+        now = time.time()
+        while True:
+            rows = [(q.query, now) for q in itertools.islice(prepared, JOB_FETCH_SIZE)]
+            if not rows:
+                break
+            added += self.db.executemany("INSERT OR IGNORE INTO queries (query, state, attempts, error, updated) "
+                                         "VALUES (?, 'pending', 0, NULL, ?)", rows).rowcount
+            self.db.commit()
+        return dict(prep.report(), added=added)
+
+    def run(self):
+        """
+        Runs the queries left: the pending ones, then the failed and captcha-blocked ones (see the class description).
+        The job can be stopped with stop() (from another thread) or by closing the generator;
+        a later run() resumes it.
+
+        YIELDS:
+            (query [str], SearchResult object) for each query done
+        RAISES:
+            YandexXMLRequestError on one of JOB_FATAL_ERRORS
+        """
+        self._stop.clear()
+        first = True
+        while not self._stop.is_set():
+            if not self._has_runnable():
+                return
+            if not first and not self._paused:
+                # only the failed queries are left
+                self._wait(time.time() + self.retry_delay)
+                if self._stop.is_set(): return
+            first = False
+            self._paused = None
+            fatal = yield from self._run_round()
+            if fatal is not None:
+                raise fatal
+            if self._stop.is_set():
+                return
+            if self._paused == 'limits':
+                self._wait_limits()
+            elif self._paused == 'rate':
+                self.stats['rate_waits'] += 1
+                self._wait(time.time() + JOB_RATE_WAIT)
+
+    def stop(self):
+        """
+        Stops the job: no more queries are sent and a wait for the limits is cut short.
+        """
+        self._stop.set()
+
+    def retry_failed(self):
+        """
+        Puts all the failed and captcha-blocked queries back to pending (with their attempts reset).
+        RETURNS:
+            number of queries [int]
+        """
+        n = self.db.execute("UPDATE queries SET state = 'pending', attempts = 0 WHERE state IN ('failed', 'captcha')").rowcount
+        self.db.commit()
+        return n
+
+    def counts(self):
+        """
+        Returns the number of queries in each state [dict] (see JOB_STATES).
+        """
+        counts = dict.fromkeys(JOB_STATES, 0)
+        counts.update(self.db.execute('SELECT state, COUNT(*) FROM queries GROUP BY state').fetchall())
+        return counts
+
+    def items(self, state='failed', limit=None):
+        """
+        Returns the queries in the given state [list of (query, attempts, last error, updated [datetime])], in the order added.
+        """
+        rows = self.db.execute('SELECT query, attempts, error, updated FROM queries WHERE state = ? ORDER BY id LIMIT ?',
+                               (state, -1 if limit is None else limit)).fetchall()
+        return [(query, attempts, error, dt.fromtimestamp(updated)) for query, attempts, error, updated in rows]
+
+    def _run_round(self):
+        # runs the queries left once; RETURNS: the fatal error, if any
+        inflight = {}           # query => journal id
+        fatal = None
+        results = self.engine.search_many(self._source(inflight), self.grouped, self.max_workers, self.pages, self.max_results)
+        try:
+            for query, result in results:
+                qid = inflight.pop(query)
+                if not isinstance(result, Exception):
+                    yield (query, result)
+                    self._set_state(qid, 'done')
+                    self.stats['done'] += 1
+                    continue
+                errorcode = getattr(result, 'errorcode', 0)
+                if errorcode == 32:
+                    # the limits are over: the query will be run in the next interval
+                    self._paused = 'limits'
+                    self._set_state(qid, 'pending', str(result))
+                elif errorcode == 55:
+                    # too many requests per second: the query will be run after a pause
+                    self._paused = self._paused or 'rate'
+                    self._set_state(qid, 'pending', str(result))
+                elif errorcode in JOB_FATAL_ERRORS:
+                    self._paused = self._paused or 'fatal'
+                    fatal = fatal or result
+                    self._set_state(qid, 'pending', str(result))
+                elif isinstance(result, CaptchaError):
+                    self.stats['captcha'] += 1
+                    self._set_state(qid, 'captcha', str(result), 1)
+                else:
+                    self.stats['failed'] += 1
+                    # the answer to a query that Yandex has rejected as such won't change: it is not run again
+                    permanent = isinstance(result, YandexXMLRequestError) and errorcode in JOB_PERMANENT_ERRORS
+                    self._set_state(qid, 'failed', str(result), self.max_attempts if permanent else 1)
+        finally:
+            results.close()
+        return fatal
+
+    def _source(self, inflight):
+        # reads the queries to run from the journal (in the order added) until the job is paused or stopped
+        last = 0
+        while True:
+            rows = self.db.execute("SELECT id, query FROM queries WHERE id > ? AND (state IN ('pending', 'captcha', 'failed')) "
+                                   "AND attempts < ? ORDER BY id LIMIT ?", (last, self.max_attempts, JOB_FETCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for qid, query in rows:
+                if self._paused or self._stop.is_set():
+                    return
+                last = qid
+                inflight[query] = qid
+                yield query
+
+    def _has_runnable(self):
+        return self.db.execute("SELECT 1 FROM queries WHERE state IN ('pending', 'captcha', 'failed') AND attempts < ? LIMIT 1",
+                               (self.max_attempts,)).fetchone() is not None
+
+    def _set_state(self, qid, state, error=None, attempts=0):
+        # 'attempts' is added to the query's number of failed runs
+        self.db.execute('UPDATE queries SET state = ?, error = ?, attempts = attempts + ?, updated = ? WHERE id = ?',
+                        (state, error, attempts, time.time(), qid))
+        self.db.commit()
+
+    def _wait_limits(self):
+        # sleeps until the next limits interval
+        wakeup = None
+        if self.engine.query_limits():
+            wakeup = next_window(self.engine.hour_limits)
+        if wakeup is None:
+            wakeup = time.time() + JOB_LIMITS_WAIT
+        print_dbg('Лимиты запросов исчерпаны: ожидание до {}'.format(dt.fromtimestamp(wakeup)))
+        self.stats['limits_waits'] += 1
+        self._wait(wakeup)
+
+    def _wait(self, wakeup):
+        started = time.time()
+        self._stop.wait(max(wakeup - started, 0))
+        self.stats['waited'] += time.time() - started
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements Metrics - the request counters and timings collected by the Yandexml
+and AsyncYandexml engines (the engine's 'metrics' property).
+
+Each HTTP call (search, limits, captcha, sample_captcha, captcha_image, ip) is recorded with its
+timing phases:
+    - connect: TCP connect and TLS handshake (only when a new connection is opened, directly or through a proxy)
+    - ttfb: time to the response headers (without 'connect')
+    - download: response body download
+    - parse: XML parsing
+    - build: building the Group / Doc objects
+    - total: whole call
+along with the bytes received (as transferred, i.e. compressed), the HTTP status and the Yandex error code (or exception name).
+
+Usage example:
+    yxml.metrics.add_callback(lambda call: print(call['endpoint'], call['timings']))
+    ...
+    print(yxml.metrics.snapshot())
+    open('metrics.prom', 'w').write(yxml.metrics.prometheus())
+"""
+
+import sys
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from globalvars import *
+
+# the call being made in the current thread / task (used to attribute connect and parse times)
+_current_call = contextvars.ContextVar('yxml_current_call', default=None)
+
+## ******************************************************************************** ##
+
+def add_time(phase, seconds):
+    """
+    Adds the time spent in a phase to the call being made in the current thread / task (if any).
+    """
+    call = _current_call.get()
+    if call is not None:
+        call.add_time(phase, seconds)
+
+class _TimedConnection:
+    # mixin of the urllib3 connection classes recording the connect time in the current call
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        add_time('connect', time.perf_counter() - start)
+
+_timed_pool_classes = {}
+
+def _timed_pool_class(pool_class):
+    # returns the subclass of a urllib3 connection pool class opening timed connections (created once per class)
+    if issubclass(pool_class.ConnectionCls, _TimedConnection):
+        return pool_class
+    timed = _timed_pool_classes.get(pool_class)
+    if timed is None:
+        connection_class = type('Timed' + pool_class.ConnectionCls.__name__, (_TimedConnection, pool_class.ConnectionCls), {})
+        timed = _timed_pool_classes[pool_class] = type('Timed' + pool_class.__name__, (pool_class,), {'ConnectionCls': connection_class})
+    return timed
+
+def _time_pools(manager):
+    # makes a urllib3 PoolManager / ProxyManager (incl. SOCKS) create timed connection pools
+    manager.pool_classes_by_scheme = {scheme: _timed_pool_class(pool_class) 
+                                      for scheme, pool_class in manager.pool_classes_by_scheme.items()}
+    return manager
+
+def wire_size(response, default=0):
+    """
+    Returns the number of body bytes of a requests Response object read from the connection so far 
+    (before decompression), or 'default' if it isn't known.
+    """
+    try:
+        return int(response.raw.tell())
+    except Exception:
+        return default
+
+def time_connections(adapter):
+    """
+    Makes the connections of a requests HTTPAdapter record their connect (and TLS handshake) time,
+    both the direct ones and those opened through proxies (the proxy managers are created by the adapter 
+    as the proxies are used, so they are patched as they are handed out).
+    """
+    _time_pools(adapter.poolmanager)
+    proxy_manager_for = adapter.proxy_manager_for
+    def timed_proxy_manager_for(proxy, **proxy_kwargs):
+        return _time_pools(proxy_manager_for(proxy, **proxy_kwargs))
+    adapter.proxy_manager_for = timed_proxy_manager_for
+    return adapter
+
+## ******************************************************************************** ##
+
+class Call:
+
+    """
+    Record of a single HTTP call.
+    """
+
+    __slots__ = ('endpoint', 'timings', 'bytes', 'status', 'error', 'started')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.timings = {}
+        self.bytes = 0
+        self.status = 0
+        self.error = None
+        self.started = time.perf_counter()
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def set_response(self, response, stream=False):
+        """
+        Records the status, size and ttfb / download times of a requests Response object
+        (for a streamed response the body size and download time are added by the caller).
+        """
+        elapsed = response.elapsed.total_seconds()
+        self.status = response.status_code
+        self.add_time('ttfb', max(0.0, elapsed - self.timings.get('connect', 0.0)))
+        if not stream:
+            self.bytes += wire_size(response, len(response.content))
+            self.add_time('download', max(0.0, time.perf_counter() - self.started - elapsed))
+
+    def as_dict(self):
+        return {'endpoint': self.endpoint, 'timings': dict(self.timings), 'bytes': self.bytes,
+                'status': self.status, 'error': self.error}
+
+class Metrics:
+
+    """
+    Thread-safe request counters and timing summaries.
+
+    Counters: requests, bytes and errors (Yandex error codes or exception names) by endpoint, retries.
+    Timings: count / sum / max (sec.) of each phase by endpoint.
+    Each finished call is also passed (as a dict, see Call.as_dict()) to the registered callbacks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = {}
+            self._bytes = {}
+            self._errors = {}
+            self._timings = {}
+            self._counters = {'retries': 0}
+
+    def add_callback(self, callback):
+        """
+        Registers a function called with the dict of each finished call (see Call.as_dict()).
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def count(self, name, n=1):
+        """
+        Increments a counter (e.g. 'retries').
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    @contextmanager
+    def call(self, endpoint):
+        """
+        Context manager recording an HTTP call: yields the Call object to fill in.
+        Exceptions are recorded as the call's error and re-raised.
+        """
+        call = Call(endpoint)
+        token = _current_call.set(call)
+        try:
+            yield call
+        except Exception as err:
+            call.error = getattr(err, 'errorcode', None) or type(err).__name__
+            raise
+        finally:
+            try:
+                _current_call.reset(token)
+            except ValueError:
+                # a generator resumed in another context
+                _current_call.set(None)
+            call.timings['total'] = time.perf_counter() - call.started
+            self._record(call)
+
+    def snapshot(self):
+        """
+        Returns the current counters and timings [dict]:
+            {'requests': {endpoint: n}, 'bytes': {endpoint: n}, 'errors': {endpoint: {error: n}},
+             'timings': {endpoint: {phase: {'count': n, 'sum': sec, 'max': sec}}}, 'retries': n, ...}
+        """
+        with self._lock:
+            snapshot = {'requests': dict(self._requests), 'bytes': dict(self._bytes),
+                        'errors': {endpoint: dict(errors) for endpoint, errors in self._errors.items()},
+                        'timings': {endpoint: {phase: dict(summary) for phase, summary in phases.items()}
+                                    for endpoint, phases in self._timings.items()}}
+            snapshot.update(self._counters)
+            return snapshot
+
+    def prometheus(self, prefix='yandexml'):
+        """
+        Returns the metrics in the Prometheus text exposition format [str].
+        """
+        snapshot = self.snapshot()
+        lines = ['# TYPE {}_requests_total counter'.format(prefix)]
+        lines += ['{}_requests_total{{endpoint="{}"}} {}'.format(prefix, endpoint, n) for endpoint, n in sorted(snapshot['requests'].items())]
+        lines.append('# TYPE {}_received_bytes_total counter'.format(prefix))
+        lines += ['{}_received_bytes_total{{endpoint="{}"}} {}'.format(prefix, endpoint, n) for endpoint, n in sorted(snapshot['bytes'].items())]
+        lines.append('# TYPE {}_errors_total counter'.format(prefix))
+        for endpoint, errors in sorted(snapshot['errors'].items()):
+            lines += ['{}_errors_total{{endpoint="{}",error="{}"}} {}'.format(prefix, endpoint, error, n) for error, n in sorted(errors.items())]
+        lines.append('# TYPE {}_phase_seconds summary'.format(prefix))
+        for endpoint, phases in sorted(snapshot['timings'].items()):
+            for phase, summary in sorted(phases.items()):
+                labels = '{{endpoint="{}",phase="{}"}}'.format(endpoint, phase)
+                lines.append('{}_phase_seconds_sum{} {:.6f}'.format(prefix, labels, summary['sum']))
+                lines.append('{}_phase_seconds_count{} {}'.format(prefix, labels, summary['count']))
+        for name in sorted(snapshot):
+            if name not in ('requests', 'bytes', 'errors', 'timings'):
+                lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+                lines.append('{}_{}_total {}'.format(prefix, name, snapshot[name]))
+        return '\n'.join(lines) + '\n'
+
+    def _record(self, call):
+        with self._lock:
+            self._requests[call.endpoint] = self._requests.get(call.endpoint, 0) + 1
+            self._bytes[call.endpoint] = self._bytes.get(call.endpoint, 0) + call.bytes
+            if call.error is not None:
+                errors = self._errors.setdefault(call.endpoint, {})
+                errors[str(call.error)] = errors.get(str(call.error), 0) + 1
+            phases = self._timings.setdefault(call.endpoint, {})
+            for phase, seconds in call.timings.items():
+                summary = phases.setdefault(phase, {'count': 0, 'sum': 0.0, 'max': 0.0})
+                summary['count'] += 1
+                summary['sum'] += seconds
+                summary['max'] = max(summary['max'], seconds)
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback(call.as_dict())
+            except Exception as err:
+                print(COLOR_ERR + 'Metrics callback error: {}'.format(err), file=sys.stderr)
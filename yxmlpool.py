@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements AccountPool - a front end spreading the search queries over several
+Yandex XML accounts (user / apikey pairs, each with its own registered IP / proxy and mode),
+so that the throughput is not capped by the limits of a single account.
+
+Usage example:
+    pool = AccountPool([{'user': 'user1', 'apikey': 'key1', 'ip': '1.2.3.4'},
+                        {'user': 'user2', 'apikey': 'key2', 'proxy': 'http://5.6.7.8:3128', 'mode': 'ru'}],
+                       captcha_solver='solver.py')
+    for query, result in pool.search_many(queries):
+        ...
+    print(pool.usage())
+"""
+
+import time
+import itertools
+import threading
+from datetime import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from yxmlengine import (Yandexml, YandexXMLError, YandexXMLRequestError, CaptchaParked, CaptchaQueue,
+                        report_error)
+from yxmlmetrics import Metrics
+from yxmlcookies import CookieStore
+from yxmlquota import current_limit
+from globalvars import *
+
+## ******************************************************************************** ##
+
+class _Account:
+
+    # pool's state of one account
+
+    def __init__(self, engine):
+        self.engine = engine
+        proxy = engine.proxy.get('https') if isinstance(engine.proxy, dict) else None
+        self.name = '{}@{}'.format(engine.user, engine.ip or proxy or 'auto')
+        self.remaining = -1         # requests left in the current limits interval (-1 = unknown)
+        self.refreshed = None       # time of the last limits update (timestamp)
+        self.refreshing = False
+        self.until = 0              # the account is quarantined until this time (timestamp), float('inf') = until the captcha is solved
+        self.in_flight = 0
+        self.stats = {'requests': 0, 'succeeded': 0, 'failed': 0, 'limits_exceeded': 0, 'ip_rejected': 0, 'captchas': 0}
+
+class AccountPool:
+
+    """
+    Pool of Yandexml engines, one per account. Each query is sent by the available account
+    with the most requests left in its current limits interval (hour for the 'ru' mode, day for the
+    'world' mode), as reported by query_limits() every 'refresh' seconds and counted down locally.
+
+    An account is put aside when a query sent by it runs into:
+        - error 32 (limits exceeded): until its next limits update shows requests left
+        - error 48 (wrong mode / IP): for 'quarantine' seconds
+        - error 100 (robot check): until its captcha has been solved (on the engines' captcha queue),
+            or for 'quarantine' seconds if it couldn't be
+    and the query is resent by another account (up to 'reroutes' times). The pool is thread-safe.
+    """
+
+    def __init__(self, accounts, refresh=QUOTA_REFRESH, quarantine=ACCOUNT_QUARANTINE, reroutes=ACCOUNT_REROUTES, **kwargs):
+        """
+        PARAMS:
+            - accounts [iterable]: Yandexml engines or dicts of their parameters ('user', 'apikey', 'mode', 'ip', 'proxy'...)
+            - refresh [int]: interval (sec.) between limits updates of each account
+            - quarantine [int]: time (sec.) an account is put aside after error 48 or a failed captcha
+            - reroutes [int]: max number of times a query is resent to another account
+            - kwargs: parameters common to the engines created from dicts (e.g. 'captcha_solver', 'cache');
+                unless given, they share one captcha queue, metrics and cookie store
+        """
+        self.refresh = refresh
+        self.quarantine = quarantine
+        self.reroutes = reroutes
+        kwargs.setdefault('captcha_queue', CaptchaQueue())
+        kwargs.setdefault('metrics', Metrics())
+        kwargs.setdefault('cookies', CookieStore())
+        kwargs['reentrant'] = True
+        self.accounts = [_Account(account if isinstance(account, Yandexml) else Yandexml(**dict(kwargs, **account)))
+                         for account in accounts]
+        if not self.accounts:
+            raise ValueError('No accounts given')
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the HTTP sessions of all the engines.
+        """
+        for account in self.accounts:
+            account.engine.close()
+
+    def search(self, query, grouped=True, pages=1, max_results=None, timeout=None):
+        """
+        Searches Yandex for the query with one of the accounts (see Yandexml.search()).
+
+        PARAMS:
+            - timeout [float|None]: max time (sec.) for the whole query, including the wait for an available account,
+                the retries and captchas (None = the 'query_timeout' of the account's engine, 0 = no limit)
+        RETURNS:
+            SearchResult object or None on failure
+        """
+        try:
+            return self._search(query, grouped, pages, max_results, timeout)
+        except Exception as err:
+            report_error(err)
+            return None
+
+    def search_many(self, queries, grouped=True, max_workers=POOL_MAXSIZE, pages=1, max_results=None, timeout=None):
+        """
+        Runs a batch of queries concurrently on a thread pool, spreading them over the accounts.
+
+        PARAMS:
+            - queries [iterable]: search queries [str] (may be a generator)
+            - max_workers [int]: number of concurrent requests (all accounts together)
+            - grouped, pages, max_results, timeout: see search()
+        RETURNS:
+            Generator yielding (query, result) tuples as the queries complete, where
+            result is a SearchResult object or the exception raised by the query.
+        """
+        queries = iter(queries)
+        pending = {}            # future => query
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            try:
+                while True:
+                    for query in itertools.islice(queries, max(max_workers * 2 - len(pending), 0)):
+                        pending[pool.submit(self._search, query, grouped, pages, max_results, timeout)] = query
+                    if not pending:
+                        break
+                    done, _ = wait(list(pending), None, FIRST_COMPLETED)
+                    for future in done:
+                        query = pending.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as err:
+                            result = err
+                        yield (query, result)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def usage(self):
+        """
+        Returns the usage of each account [list of dict]: 'account' (user@IP), 'mode', 'remaining'
+        (requests left in the current limits interval, -1 = unknown), 'available_at' (end of the
+        quarantine [datetime] or None if the account is available), and the request counters:
+        'requests', 'succeeded', 'failed', 'limits_exceeded' (error 32), 'ip_rejected' (error 48),
+        'captchas' (error 100).
+        """
+        now = time.time()
+        with self._cond:
+            return [dict(account.stats, account=account.name, mode=account.engine.mode, remaining=account.remaining,
+                         available_at=None if account.until <= now else (
+                                 dt.max if account.until == float('inf') else dt.fromtimestamp(account.until)))
+                    for account in self.accounts]
+
+    def _search(self, query, grouped=True, pages=1, max_results=None, timeout=None):
+        # sends the query by the best account, rerouting it on errors 32 / 48 / 100
+        deadline = time.time() + timeout if timeout else None
+        for _ in range(self.reroutes + 1):
+            account = self._acquire(deadline)
+            if timeout is None and deadline is None:
+                # the query's deadline (kept over the reroutes) is set by the first account's engine
+                deadline = account.engine._make_deadline()
+            try:
+                result = account.engine._search_pages(query, grouped, pages, max_results, True, deadline)
+            except CaptchaParked as err:
+                self._release(account, captcha=err.ticket)
+                continue
+            except YandexXMLRequestError as err:
+                self._release(account, error=err)
+                if err.errorcode in (32, 48): continue
+                raise
+            except BaseException as err:
+                self._release(account, error=err)
+                raise
+            self._release(account)
+            return result
+        raise YandexXMLError('Превышено число повторов запроса с другими аккаунтами', query)
+
+    def _acquire(self, deadline=None):
+        # waits for the available account with the most requests left and reserves a request
+        while True:
+            with self._cond:
+                now = time.time()
+                stale = [account for account in self.accounts if not account.refreshing and account.until <= now
+                         and (account.refreshed is None or now - account.refreshed >= self.refresh)]
+                for account in stale:
+                    account.refreshing = True
+            for account in stale:
+                self._refresh(account)
+            with self._cond:
+                now = time.time()
+                available = [account for account in self.accounts
+                             if not account.refreshing and account.until <= now and account.remaining != 0]
+                if available:
+                    account = max(available, key=lambda account: (account.remaining, -account.in_flight))
+                    if account.remaining > 0:
+                        account.remaining -= 1
+                    account.in_flight += 1
+                    account.stats['requests'] += 1
+                    return account
+                # wait for a quarantine to end or limits to be updated
+                wakeup = [account.until if account.until > now else account.refreshed + self.refresh
+                          for account in self.accounts if not account.refreshing]
+                wakeup = min(wakeup) if wakeup else None
+                if deadline is not None:
+                    if now >= deadline:
+                        raise YandexXMLError('Нет доступных аккаунтов (исчерпаны лимиты или аккаунты заблокированы)')
+                    wakeup = deadline if wakeup is None else min(wakeup, deadline)
+                self._cond.wait(None if wakeup is None or wakeup == float('inf') else max(wakeup - now, 0))
+
+    def _release(self, account, error=None, captcha=None):
+        with self._cond:
+            account.in_flight -= 1
+            if captcha is not None:
+                account.stats['captchas'] += 1
+                if not captcha.done():
+                    account.until = float('inf')
+            elif error is None:
+                account.stats['succeeded'] += 1
+            else:
+                account.stats['failed'] += 1
+                errorcode = getattr(error, 'errorcode', 0)
+                if errorcode == 32:
+                    account.stats['limits_exceeded'] += 1
+                    account.remaining = 0
+                elif errorcode == 48:
+                    account.stats['ip_rejected'] += 1
+                    account.until = time.time() + self.quarantine
+            self._cond.notify_all()
+        if captcha is not None:
+            captcha.add_done_callback(lambda ticket: self._captcha_done(account, ticket))
+
+    def _captcha_done(self, account, ticket):
+        with self._cond:
+            if account.until == float('inf'):
+                account.until = 0 if ticket.exception() is None else time.time() + self.quarantine
+            self._cond.notify_all()
+
+    def _refresh(self, account):
+        # updates the number of requests left in the account's current limits interval
+        remaining = -1
+        if account.engine.query_limits():
+            remaining = max(current_limit(account.engine.hour_limits), -1)
+        with self._cond:
+            account.remaining = remaining
+            account.refreshed = time.time()
+            account.refreshing = False
+            self._cond.notify_all()
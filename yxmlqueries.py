@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements QueryPreprocessor - a single-pass preprocessor of bulk query lists
+(e.g. query files of millions of lines). Each query is normalized and truncated the same way
+the engines do it (see yxmlengine.normalize_query()), validated, de-duplicated and turned into
+its ready-to-send request body; the rejected and truncated queries are reported.
+
+Usage example:
+    prep = QueryPreprocessor(grouped=True)
+    with open('queries.txt', encoding='utf-8') as f:
+        for query, result in yxml.search_many(q.query for q in prep.process(f)):
+            ...
+    print(prep.report())
+"""
+
+import re
+from collections import namedtuple
+from yxmlengine import truncate_query, make_query_body
+from globalvars import *
+
+# characters not allowed in XML 1.0 (the whitespace ones are removed by the normalization)
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+## ******************************************************************************** ##
+
+class PreparedQuery(namedtuple('PreparedQuery', ['line', 'query', 'body'])):
+    """
+    Accepted query: source line number [int], normalized query [str] and request body
+    of its first results page [bytes] (see yxmlengine.make_query_body()).
+    """
+    __slots__ = ()
+
+class QueryPreprocessor:
+
+    """
+    Normalizes, validates, truncates and de-duplicates queries in one pass over the list
+    (the time is linear in the total length of the queries).
+
+    A query is rejected if it is empty after the normalization ('empty'), is not valid UTF-8
+    ('encoding', for queries given as bytes) or contains characters not allowed in XML ('invalid_chars').
+    A query cut to MAX_QUERY_CHARS characters / MAX_QUERY_WORDS words is accepted and reported
+    as truncated. With 'dedupe', a query equal to an earlier one (after the normalization) is skipped.
+    The counters ('lines', 'accepted', 'rejected', 'truncated', 'duplicates') cover the whole list,
+    the 'rejected' and 'truncated' lists only the first 'report_limit' queries of each kind.
+    """
+
+    def __init__(self, grouped=True, dedupe=True, report_limit=QUERY_REPORT_LIMIT):
+        """
+        PARAMS:
+            - grouped [bool]: whether the request bodies ask for results grouped by domain name
+            - dedupe [bool]: skip the repeated queries
+            - report_limit [int]: max number of rejected / truncated queries listed in the report
+        """
+        self.grouped = grouped
+        self.dedupe = dedupe
+        self.report_limit = report_limit
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the report and the queries seen so far.
+        """
+        self.stats = {'lines': 0, 'accepted': 0, 'rejected': 0, 'truncated': 0, 'duplicates': 0}
+        self.rejected = []          # (line number, query, reason)
+        self.truncated = []         # (line number, query, normalized query)
+        self._seen = set()
+
+    def process(self, lines, start=1):
+        """
+        Preprocesses a list of queries.
+
+        PARAMS:
+            - lines [iterable]: queries [str|bytes], one per item (e.g. an open file, may be a generator)
+            - start [int]: number of the first line
+        YIELDS:
+            PreparedQuery object for each accepted query (in the list order)
+        """
+        for n, line in enumerate(lines, start):
+            prepared = self.prepare(line, n)
+            if prepared is not None:
+                yield prepared
+
+    def prepare(self, line, n=0):
+        """
+        Preprocesses one query (see process()).
+        RETURNS:
+            PreparedQuery object or None if the query has been rejected or is a duplicate
+        """
+        self.stats['lines'] += 1
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                return self._reject(n, line.decode('utf-8', 'replace'), 'encoding')
+        query, truncated = truncate_query(line)
+        if not query:
+            return self._reject(n, line, 'empty')
+        if _INVALID_XML_CHARS.search(query):
+            return self._reject(n, line, 'invalid_chars')
+        if self.dedupe:
+            if query in self._seen:
+                self.stats['duplicates'] += 1
+                return None
+            self._seen.add(query)
+        if truncated:
+            self.stats['truncated'] += 1
+            if len(self.truncated) < self.report_limit:
+                self.truncated.append((n, line.rstrip('\r\n'), query))
+        self.stats['accepted'] += 1
+        return PreparedQuery(n, query, make_query_body(query, self.grouped, 0))
+
+    def report(self):
+        """
+        Returns the preprocessing report [dict]: the counters (see the class description) and
+        the lists 'rejected_queries' [(line number, query, reason), ...] and
+        'truncated_queries' [(line number, query, normalized query), ...].
+        """
+        return dict(self.stats, rejected_queries=list(self.rejected), truncated_queries=list(self.truncated))
+
+    def _reject(self, n, line, reason):
+        self.stats['rejected'] += 1
+        if len(self.rejected) < self.report_limit:
+            self.rejected.append((n, line.rstrip('\r\n'), reason))
+        return None
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements QuotaScheduler - the request limits scheduler that can be passed to
+Yandexml ('scheduler' parameter) to spread the search requests evenly over the available limits
+instead of running into error 32 (limits exceeded).
+
+Usage example:
+    yxml = Yandexml(user, apikey, 'ru', scheduler=QuotaScheduler())
+    for query, result in yxml.search_many(queries):
+        ...
+"""
+
+import time
+import bisect
+import threading
+from datetime import datetime as dt, timedelta, timezone
+from yxmlengine import print_err
+from globalvars import *
+
+## ******************************************************************************** ##
+
+def day_end(now):
+    """
+    Returns the time [float timestamp] the daily limits are reset after 'now' (midnight in the QUOTA_DAY_UTC_OFFSET time zone).
+    """
+    tz = timezone(timedelta(hours=QUOTA_DAY_UTC_OFFSET))
+    return (dt.fromtimestamp(now, tz).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+
+def next_window(hour_limits, now=None):
+    """
+    Returns the start [float timestamp] of the next limits interval (after the current one) with requests left.
+
+    PARAMS:
+        - hour_limits [dict]: the engine's limits (see Yandexml.query_limits())
+        - now [float|None]: current time (timestamp)
+    RETURNS:
+        the next hour with a non-zero limit for the hourly limits ('ru' mode), the next midnight for
+        the daily limits ('world' mode), None if the limits are unknown or there are none left in the reported hours
+    """
+    if now is None:
+        now = time.time()
+    if hour_limits['hours']:
+        for start, limit in hour_limits['hours']:
+            if start.timestamp() > now and limit > 0:
+                return start.timestamp()
+        return None
+    if hour_limits['day'] >= 0:
+        return day_end(now)
+    return None
+
+def current_limit(hour_limits, now=None):
+    """
+    Returns the number of requests [int] left in the limits interval containing 'now' (-1 if unknown).
+
+    PARAMS:
+        - hour_limits [dict]: the engine's limits (see Yandexml.query_limits())
+        - now [float|None]: current time (timestamp)
+    RETURNS:
+        the limit of the current hour for the hourly limits ('ru' mode), the daily limit ('world' mode)
+    """
+    if now is None:
+        now = time.time()
+    hours = hour_limits['hours']
+    if hours:
+        # same lookup as QuotaScheduler._find_window(): the last interval starting before 'now', if it hasn't ended yet
+        index = bisect.bisect_right([start.timestamp() for start, _ in hours], now) - 1
+        if index >= 0 and hours[index][0].timestamp() + 3600 > now:
+            return hours[index][1]
+        return -1
+    return hour_limits['day']
+
+class QuotaScheduler:
+
+    """
+    Token bucket per limits interval (hour for the 'ru' mode, day for the 'world' mode),
+    seeded from the engine's query_limits() and refreshed every 'refresh' seconds.
+
+    Each search request takes a token (see acquire()). With 'pace' on, the requests are spaced evenly
+    over the rest of the interval, so that a batch spends the available limits at a steady rate;
+    the requests that don't fit into the current interval wait for the next one.
+    The limits are fetched by one of the requesting threads without blocking the others; if they can't be
+    fetched, the update is retried in QUOTA_RETRY_DELAY seconds and, while no valid limits are known,
+    the requests are not throttled (the engine still gets error 32 if the limits are over).
+    The scheduler is thread-safe and can be shared by several engines of the same account.
+    """
+
+    def __init__(self, refresh=QUOTA_REFRESH, pace=True):
+        """
+        PARAMS:
+            - refresh [int]: interval (sec.) between limits updates
+            - pace [bool]: spread the requests evenly over each interval (False = send them as fast as the limits allow)
+        """
+        self.refresh = refresh
+        self.pace = pace
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._windows = []          # [start, end, tokens] (times as timestamps), sorted by start
+        self._starts = []
+        self._next_slot = 0
+        self._refreshed = None      # time of the last limits update
+        self._next_refresh = 0      # time of the next limits update
+        self._updating = False      # the limits are being fetched (by one of the threads)
+        self._failed = False        # the last limits update has failed
+        self.stats = {'granted': 0, 'waited': 0.0, 'refreshes': 0, 'failed_refreshes': 0, 'unthrottled': 0, 'exhausted': 0}
+
+    def acquire(self, engine, timeout=None):
+        """
+        Takes a token for one search request, waiting for it if necessary.
+
+        PARAMS:
+            - engine [Yandexml]: the engine sending the request (used to update the limits)
+            - timeout [float|None]: max time to wait (sec.), None = as long as it takes
+        RETURNS:
+            True if the request may be sent, False if there will be no limits left before the timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                now = time.time()
+                update = self._is_stale(now) and not self._updating
+                if update:
+                    self._updating = True
+                elif self._updating and self._refreshed is None:
+                    # the first limits are being fetched by another thread
+                    if not self._wait_update(deadline):
+                        return False
+                    continue
+                else:
+                    slot = self._reserve(now, deadline)
+                    if slot is None:
+                        if self._failed:
+                            # the limits are unknown: the request is let through
+                            self.stats['granted'] += 1
+                            self.stats['unthrottled'] += 1
+                            return True
+                        if self._updating:
+                            if not self._wait_update(deadline):
+                                return False
+                            continue
+                        # no limits left: wait for the next update
+                        slot = self._next_refresh
+                        if self._windows and self._windows[-1][1] > now:
+                            slot = min(slot, self._windows[-1][1])
+                        if deadline is not None and slot > deadline:
+                            return False
+                        reserved = False
+                    elif slot < 0:
+                        return False
+                    else:
+                        reserved = True
+
+            if update:
+                # the request is sent without holding the lock
+                self._update(engine)
+                continue
+            delay = slot - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if reserved:
+                with self._lock:
+                    self.stats['granted'] += 1
+                    self.stats['waited'] += max(delay, 0)
+                return True
+
+    def exhausted(self):
+        """
+        Marks the current interval as exhausted (call on error 32), so that the following requests
+        wait for the next interval.
+        """
+        with self._lock:
+            index = self._find_window(time.time())
+            if index >= 0:
+                self._windows[index][2] = 0
+            self._next_slot = 0
+            self.stats['exhausted'] += 1
+
+    def remaining(self):
+        """
+        Returns the number of requests [int] left in the current interval (-1 if unknown).
+        """
+        with self._lock:
+            index = self._find_window(time.time())
+            return self._windows[index][2] if index >= 0 else -1
+
+    def next_window(self):
+        """
+        Returns the start time [datetime] of the first interval (from now on) with limits left, or None if unknown.
+        """
+        with self._lock:
+            now = time.time()
+            for start, end, tokens in self._windows:
+                if end > now and tokens > 0:
+                    return dt.fromtimestamp(max(start, now), timezone.utc)
+            return None
+
+    def _reserve(self, now, deadline):
+        # returns the time slot for the next request (-1 = not before the deadline) or None if there are no limits left
+        index = max(self._find_window(now), 0)
+        for window in self._windows[index:]:
+            start, end, tokens = window
+            if end <= now or tokens <= 0:
+                continue
+            slot = max(now, start, self._next_slot if self._next_slot < end else 0)
+            # a request that can go right away is never late (timeout=0 = don't wait)
+            if deadline is not None and slot > max(now, deadline):
+                return -1
+            window[2] -= 1
+            self._next_slot = slot + (end - slot) / tokens if self.pace else slot
+            return slot
+        return None
+
+    def _find_window(self, now):
+        index = bisect.bisect_right(self._starts, now) - 1
+        if index >= 0 and self._windows[index][1] <= now:
+            return -1
+        return index
+
+    def _is_stale(self, now):
+        if self._refreshed is None or now >= self._next_refresh:
+            return True
+        return not self._failed and bool(self._windows) and now >= self._windows[-1][1]
+
+    def _wait_update(self, deadline):
+        # waits (holding the lock) for the limits update in progress; RETURNS: False if the deadline has passed
+        timeout = None if deadline is None else deadline - time.time()
+        if timeout is not None and timeout <= 0:
+            return False
+        self._updated.wait(timeout)
+        return True
+
+    def _update(self, engine):
+        # fetches the limits and swaps them in
+        ok = False
+        try:
+            ok = engine.query_limits()
+            hour_limits = engine.hour_limits
+        finally:
+            now = time.time()
+            with self._lock:
+                self._updating = False
+                self._refreshed = now
+                self.stats['refreshes'] += 1
+                if ok:
+                    if hour_limits['hours']:
+                        self._windows = [[t.timestamp(), t.timestamp() + 3600, lim] for t, lim in hour_limits['hours']]
+                    elif hour_limits['day'] >= 0:
+                        self._windows = [[now, day_end(now), hour_limits['day']]]
+                    else:
+                        self._windows = []
+                    self._starts = [window[0] for window in self._windows]
+                    self._next_slot = 0
+                    self._failed = False
+                    self._next_refresh = now + self.refresh
+                else:
+                    # the old limits (if any) are used until the update succeeds
+                    self._failed = True
+                    self.stats['failed_refreshes'] += 1
+                    self._next_refresh = now + min(QUOTA_RETRY_DELAY, self.refresh)
+                self._updated.notify_all()
+        if not ok:
+            print_err('Невозможно обновить данные по лимитам запросов, повтор через {} сек.'.format(min(QUOTA_RETRY_DELAY, self.refresh)))
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements SolverPool - a pool of long-lived captcha solver processes that can be
+passed to Yandexml / AsyncYandexml as 'captcha_solver'. Unlike a solver given as a path to a script
+(which is started anew for each captcha), the solver processes are started once and receive
+the captchas through their stdin / stdout as JSON lines:
+    request:  {"id": 1, "url": "<captcha image URL>"}   or   {"id": 2, "ping": true}
+    response: {"id": 1, "result": "<captcha text>"}     or   {"id": 1, "error": "<message>"}   or   {"id": 2, "pong": true}
+
+A solver script only has to implement the solving function and call serve():
+    from yxmlsolver import serve
+    def solve(img_url):
+        ...
+        return text
+    if __name__ == '__main__':
+        serve(solve)
+
+Usage example:
+    with SolverPool('ocr_solver.py', workers=2) as solver:
+        yxml = Yandexml(user, apikey, 'world', captcha_solver=solver)
+        ...
+"""
+
+import sys
+import json
+import queue
+import threading
+import subprocess
+from yxmlengine import YandexXMLError, CaptchaError, print_err
+from globalvars import *
+
+## ******************************************************************************** ##
+
+class SolverCrashed(CaptchaError):
+    """
+    Raised when the solver process has exited (or couldn't be written to).
+    """
+    pass
+
+def serve(solve, infile=sys.stdin, outfile=sys.stdout):
+    """
+    Runs the solver side of the protocol: reads the requests from 'infile' until EOF
+    and writes the responses to 'outfile'.
+
+    PARAMS:
+        - solve [callable]: function taking the captcha image URL and returning the captcha text
+    """
+    for line in infile:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+        response = {'id': request.get('id')}
+        if request.get('ping'):
+            response['pong'] = True
+        else:
+            try:
+                response['result'] = str(solve(request['url']))
+            except Exception as err:
+                response['error'] = str(err) or type(err).__name__
+        outfile.write(json.dumps(response, ensure_ascii=False) + '\n')
+        outfile.flush()
+
+## ******************************************************************************** ##
+
+class SolverProcess:
+
+    """
+    A single solver process. It is started on first use and restarted after a crash or a timeout
+    (a process that didn't answer in time is killed, as it may be stuck).
+    Not thread-safe: SolverPool gives each process to one thread at a time.
+    """
+
+    def __init__(self, command, timeout=CAPTCHA_SOLVER_TIMEOUT, start_timeout=CAPTCHA_SOLVER_START_TIMEOUT):
+        """
+        PARAMS:
+            - command [list]: the command line starting the solver
+            - timeout [float]: max time (sec.) to solve a captcha
+            - start_timeout [float]: max time (sec.) for a new process to answer the first ping
+        """
+        self.command = command
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.process = None
+        self._responses = None
+        self._next_id = 0
+        self.stats = {'started': 0, 'solved': 0, 'errors': 0, 'timeouts': 0, 'crashes': 0}
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        Starts the process (stopping the old one, if any) and waits for it to answer a ping.
+        RAISES:
+            YandexXMLError if the process doesn't start or answer in time
+        """
+        self.stop()
+        try:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            encoding='utf-8', bufsize=1)
+        except OSError as err:
+            raise CaptchaError('Невозможно запустить решатель капчи: {}'.format(err), ' '.join(self.command))
+        self.stats['started'] += 1
+        # stdout is read on a separate thread, so that the responses can be waited for with a timeout on any OS
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read, args=(self.process.stdout, self._responses), name='yxml-solver-reader', daemon=True).start()
+        self._request({'ping': True}, self.start_timeout)
+
+    def stop(self):
+        if self.process is None: return
+        process, self.process = self.process, None
+        try:
+            # the solver exits on EOF
+            process.stdin.close()
+            process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+
+    def ping(self, timeout=5):
+        """
+        Health check: returns True if the process answers in time.
+        """
+        if not self.alive:
+            return False
+        try:
+            self._request({'ping': True}, timeout)
+            return True
+        except YandexXMLError:
+            return False
+
+    def solve(self, img_url):
+        """
+        Returns the captcha text [str] for the image URL, (re)starting the process if necessary.
+        RAISES:
+            YandexXMLError on the solver's error, crash or timeout
+        """
+        if not self.alive:
+            if self.process is not None:
+                self.stats['crashes'] += 1
+            self.start()
+        response = self._request({'url': img_url}, self.timeout)
+        if 'error' in response:
+            self.stats['errors'] += 1
+            raise CaptchaError('Ошибка решателя капчи: {}'.format(response['error']), img_url)
+        self.stats['solved'] += 1
+        return str(response.get('result', ''))
+
+    def _request(self, request, timeout):
+        self._next_id += 1
+        request['id'] = self._next_id
+        try:
+            self.process.stdin.write(json.dumps(request, ensure_ascii=False) + '\n')
+            self.process.stdin.flush()
+        except (OSError, ValueError):
+            self.stats['crashes'] += 1
+            self.stop()
+            raise SolverCrashed('Решатель капчи завершил работу', ' '.join(self.command))
+        while True:
+            try:
+                line = self._responses.get(timeout=timeout)
+            except queue.Empty:
+                self.stats['timeouts'] += 1
+                self.stop()
+                raise CaptchaError('Превышено время ожидания ответа решателя капчи', ' '.join(self.command))
+            if line is None:
+                self.stats['crashes'] += 1
+                self.stop()
+                raise SolverCrashed('Решатель капчи завершил работу', ' '.join(self.command))
+            try:
+                response = json.loads(line)
+            except ValueError:
+                # not a protocol line (e.g. the solver's own output)
+                continue
+            if isinstance(response, dict) and response.get('id') == request['id']:
+                return response
+
+    @staticmethod
+    def _read(stdout, responses):
+        try:
+            for line in stdout:
+                responses.put(line)
+        except (OSError, ValueError):
+            pass
+        responses.put(None)
+
+## ******************************************************************************** ##
+
+class SolverPool:
+
+    """
+    Pool of long-lived solver processes, callable like any other captcha_solver function:
+    solver(img_url) => captcha text. Each call takes an idle process (waiting for one if all are busy);
+    a call that fails because the process has crashed is retried once on a restarted process.
+    The pool is thread-safe.
+    """
+
+    def __init__(self, solver, workers=1, timeout=CAPTCHA_SOLVER_TIMEOUT, start_timeout=CAPTCHA_SOLVER_START_TIMEOUT, args=()):
+        """
+        PARAMS:
+            - solver [str|list]: path to the solver script (*.py) / executable or the whole command line [list]
+            - workers [int]: number of solver processes
+            - timeout [float]: max time (sec.) to solve a captcha
+            - start_timeout [float]: max time (sec.) for a process to start (e.g. load its model)
+            - args [iterable]: additional command line arguments
+        """
+        if isinstance(solver, str):
+            command = [sys.executable, solver] if solver.lower().endswith('.py') else [solver]
+        else:
+            command = list(solver)
+        command += [str(arg) for arg in args]
+        self.processes = [SolverProcess(command, timeout, start_timeout) for _ in range(max(workers, 1))]
+        self._idle = queue.Queue()
+        for process in self.processes:
+            self._idle.put(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __call__(self, img_url):
+        process = self._idle.get()
+        try:
+            try:
+                return process.solve(img_url)
+            except SolverCrashed as err:
+                print_err('{}: перезапуск'.format(err.message))
+                return process.solve(img_url)
+        finally:
+            self._idle.put(process)
+
+    def start(self):
+        """
+        Starts all the processes in advance (otherwise they are started on first use).
+        """
+        for process in self.processes:
+            if not process.alive:
+                process.start()
+
+    def check(self, restart=True, timeout=5):
+        """
+        Pings the idle processes; the ones that are not running or don't answer are (re)started
+        if 'restart' is True (otherwise they are started on next use).
+        RETURNS:
+            number of healthy processes [int]
+        """
+        healthy = 0
+        checked = []
+        while True:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            checked.append(process)
+            if process.ping(timeout):
+                healthy += 1
+            elif restart:
+                try:
+                    process.start()
+                    healthy += 1
+                except YandexXMLError as err:
+                    print_err(err.message)
+        for process in checked:
+            self._idle.put(process)
+        return healthy
+
+    @property
+    def stats(self):
+        stats = {}
+        for process in self.processes:
+            for k, v in process.stats.items():
+                stats[k] = stats.get(k, 0) + v
+        return stats
+
+    def close(self):
+        """
+        Stops all the processes (waiting for the busy ones to finish).
+        """
+        for _ in self.processes:
+            self._idle.get().stop()
+        for process in self.processes:
+            self._idle.put(process)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE.txt or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the Pynxml project hosted at https://github.com/S0mbre/yandexml.
+
+This module implements StubYandexServer - a local stand-in for the Yandex XML server used to run
+the engine offline (see benchmark.py). It serves synthetic search results, limits info, robot checks
+(captchas) and errors with configurable latency and failure rates.
+
+Usage example:
+    with StubYandexServer(groups=10, latency=0.01) as server:
+        yxml = Yandexml('user', 'apikey', 'world', ip='127.0.0.1', host=server.url)
+        yxml.search('my query')
+"""
+
+import sys
+import time
+import gzip
+import random
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime as dt, timedelta, timezone
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from globalvars import *
+
+STUB_CAPTCHA_ANSWER = '42'
+STUB_COOKIE = 'spravka'
+STUB_ERRORS = {15: 'Sorry, there are no results for this search',
+               32: 'Limit of queries exceeded',
+               48: 'Wrong type of search',
+               55: 'Request rate limit exceeded',
+               100: 'Robot request'}
+
+## ******************************************************************************** ##
+
+def make_search_xml(query='', page=0, groups=10, docs_in_group=3, found=None, grouped=True, passages=2, hlword=None):
+    """
+    Returns synthetic Yandex XML search results [str] with 'groups' groups of 'docs_in_group' documents each.
+    'found' is the total number of documents reported (default = as many as MAX_RESULTS groups would contain);
+    'hlword' is the highlighted word in the titles and headlines (default = first word of the query).
+    """
+    if found is None:
+        found = MAX_RESULTS * docs_in_group
+    if hlword is None:
+        hlword = query.split()[0] if query.split() else 'query'
+    out = ['<?xml version="1.0" encoding="utf-8"?>\n<yandexsearch version="1.0">\n<request>\n',
+           '<query>{}</query>\n<page>{}</page>\n<sortby order="descending" priority="no">rlv</sortby>\n'.format(escape(query), page),
+           '<maxpassages>{}</maxpassages>\n<groupings>\n'.format(MAX_PASSAGES),
+           '<groupby attr="{}" mode="{}" groups-on-page="{}" docs-in-group="{}" curcateg="-1"/>\n'.format(
+                   'd' if grouped else '', 'deep' if grouped else 'flat', MAX_GROUPS_ON_PAGE, docs_in_group if grouped else 1),
+           '</groupings>\n</request>\n<response date="{}">\n<reqid>1560000000000000-0000000000000000000-stub</reqid>\n'.format(
+                   dt.utcnow().strftime('%Y%m%dT%H%M%S')),
+           '<found priority="phrase">{0}</found>\n<found priority="strict">{0}</found>\n<found priority="all">{0}</found>\n'.format(found),
+           '<found-human>Found {} answers</found-human>\n<results>\n'.format(found),
+           '<grouping attr="d" mode="deep" groups-on-page="{}" docs-in-group="{}" curcateg="-1">\n'.format(MAX_GROUPS_ON_PAGE, docs_in_group),
+           '<found priority="all">{}</found>\n<found-docs priority="all">{}</found-docs>\n'.format(-(-found // max(docs_in_group, 1)), found),
+           '<found-docs-human>found {} answers</found-docs-human>\n'.format(found),
+           '<page first="{}" last="{}">{}</page>\n'.format(page * MAX_GROUPS_ON_PAGE + 1, page * MAX_GROUPS_ON_PAGE + groups, page)]
+    for g in range(page * MAX_GROUPS_ON_PAGE, page * MAX_GROUPS_ON_PAGE + groups):
+        domain = 'www.site{}.example.com'.format(g)
+        out.append('<group>\n<categ attr="d" name="{}"/>\n<doccount>{}</doccount>\n<relevance priority="all"/>\n'.format(domain, docs_in_group * 10))
+        for d in range(docs_in_group):
+            out.append('<doc id="Z{0}D{1}">\n<relevance/>\n<url>https://{2}/articles/{1}/{3}.html</url>\n<domain>{2}</domain>\n'
+                       '<title><hlword>{4}</hlword> - article {1} on site {0}</title>\n'
+                       '<headline>Headline of article {1} about <hlword>{4}</hlword></headline>\n'
+                       '<modtime>20190{5}1{6}T12{8}0{5}0</modtime>\n<size>{7}</size>\n<charset>utf-8</charset>\n<passages>\n'.format(
+                               g, d, domain, page, escape(hlword), d % 9 + 1, g % 10, 10000 + 37 * g + d, g % 6))
+            for p in range(passages):
+                out.append('<passage>Passage {} of document {}: some text around the found <hlword>words</hlword> '
+                           'that is long enough to look like a real snippet.</passage>\n'.format(p, d))
+            out.append('</passages>\n<properties>\n<_PassagesType>0</_PassagesType>\n<lang>ru</lang>\n</properties>\n'
+                       '<mime-type>text/html</mime-type>\n<saved-copy-url>https://hghltd.yandex.net/yandbtm?fmode=inject&amp;url=https%3A%2F%2F{}</saved-copy-url>\n'
+                       '</doc>\n'.format(domain))
+        out.append('</group>\n')
+    out.append('</grouping>\n</results>\n</response>\n</yandexsearch>\n')
+    return ''.join(out)
+
+def make_error_xml(code, query=''):
+    """
+    Returns a Yandex XML error response [str] (see STUB_ERRORS for the known codes).
+    """
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<yandexsearch version="1.0">\n<request>\n<query>{}</query>\n</request>\n'
+            '<response>\n<error code="{}">{}</error>\n</response>\n</yandexsearch>\n').format(escape(query), code, STUB_ERRORS.get(code, 'Error'))
+
+def make_captcha_xml(img_url, key):
+    """
+    Returns a Yandex XML robot check (error 100) response [str].
+    """
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<yandexsearch version="1.0">\n<response>\n<error code="100">Robot request</error>\n'
+            '</response>\n<captcha-img-url>{}</captcha-img-url>\n<captcha-key>{}</captcha-key>\n<captcha-status>failed</captcha-status>\n'
+            '</yandexsearch>\n').format(escape(img_url), key)
+
+def make_limits_xml(mode='world', limit=1000, when=None):
+    """
+    Returns a Yandex XML limits info response [str]: 24 hourly intervals for the 'ru' mode, one daily interval otherwise.
+    """
+    when = (when or dt.now(timezone.utc)).replace(minute=0, second=0, microsecond=0)
+    intervals = 24 if mode == 'ru' else 1
+    out = ['<?xml version="1.0" encoding="utf-8"?>\n<yandexsearch version="1.0">\n<response>\n<limits>\n']
+    for h in range(intervals):
+        start = when + timedelta(hours=h)
+        end = start + timedelta(hours=1 if mode == 'ru' else 24)
+        out.append('<time-interval from="{}" to="{}">{}</time-interval>\n'.format(
+                start.strftime('%Y-%m-%d %H-%M-%S %z'), end.strftime('%Y-%m-%d %H-%M-%S %z'), limit))
+    out.append('</limits>\n</response>\n</yandexsearch>\n')
+    return ''.join(out)
+
+## ******************************************************************************** ##
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+
+        if url.path == '/search/xml' and params.get('action') == 'limits-info':
+            endpoint = 'limits'
+        elif url.path == '/search/xml' and params.get('showmecaptcha') == 'yes':
+            endpoint = 'sample_captcha'
+        elif url.path == '/search/xml':
+            endpoint = 'search'
+        elif url.path == '/xcheckcaptcha':
+            endpoint = 'captcha'
+        else:
+            self._reply(404, 'Not found', 'text/plain')
+            return
+        server.count(endpoint)
+
+        if server.latency or server.jitter:
+            time.sleep(max(0, server.latency + server.random(-server.jitter, server.jitter)))
+        if endpoint != 'captcha' and server.random() < server.failure_rate:
+            server.count('failures')
+            self._reply(503, '<html><body>Service unavailable</body></html>', 'text/html')
+            return
+
+        if endpoint == 'limits':
+            self._reply(200, make_limits_xml(server.mode, server.limit))
+
+        elif endpoint == 'sample_captcha':
+            self._reply(200, make_captcha_xml(server.url + '/captcha.gif', server.new_captcha_key()))
+
+        elif endpoint == 'captcha':
+            if params.get('rep') == server.captcha_answer and server.check_captcha_key(params.get('key')):
+                server.count('captchas_solved')
+                self._reply(200, '<?xml version="1.0" encoding="utf-8"?>\n<yandexsearch version="1.0"/>\n',
+                            cookie='{}={}; Path=/'.format(STUB_COOKIE, server.new_captcha_key()))
+            else:
+                self._reply(200, make_captcha_xml(server.url + '/captcha.gif', server.new_captcha_key()))
+
+        else:
+            try:
+                request = ET.fromstring(body)
+                query = request.findtext('query', '')
+                page = int(request.findtext('page', '0') or 0)
+                groupby = request.find('groupings/groupby')
+                grouped = groupby is None or groupby.get('attr') == 'd'
+                docs_in_group = server.docs_in_group or (int(groupby.get('docs-in-group')) if groupby is not None else 1)
+            except (ET.ParseError, ValueError, TypeError):
+                self._reply(200, make_error_xml(2))
+                return
+            if server.error_code:
+                self._reply(200, make_error_xml(server.error_code, query))
+            elif STUB_COOKIE not in self.headers.get('Cookie', '') and server.random() < server.captcha_rate:
+                server.count('captchas')
+                self._reply(200, make_captcha_xml(server.url + '/captcha.gif', server.new_captcha_key()))
+            else:
+                found = server.found if server.found is not None else MAX_RESULTS * docs_in_group
+                groups = min(server.groups, max(0, -(-found // docs_in_group) - page * MAX_GROUPS_ON_PAGE))
+                self._reply(200, server.search_xml(query, page, groups, docs_in_group, found, grouped))
+
+    def _reply(self, code, text, content_type='text/xml; charset=utf-8', cookie=None):
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if self.server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data, self.server.compress)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count('bytes_sent', len(data))
+
+class StubYandexServer(ThreadingHTTPServer):
+
+    """
+    Local stand-in for the Yandex XML server running in a background thread.
+
+    Endpoints:
+        - POST /search/xml: search results (see make_search_xml()), an error ('error_code') or a captcha ('captcha_rate')
+        - GET /search/xml?action=limits-info: limits info (see make_limits_xml())
+        - GET /search/xml?showmecaptcha=yes: sample captcha
+        - GET /xcheckcaptcha: captcha check (the answer is 'captcha_answer'); sets the robot check cookie
+    The number of requests to each endpoint is counted in 'stats'.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, groups=MAX_GROUPS_ON_PAGE, docs_in_group=None, found=None, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, captcha_rate=0.0, error_code=0, mode='world', limit=1000,
+                 captcha_answer=STUB_CAPTCHA_ANSWER, seed=None, port=0, compress=6):
+        """
+        PARAMS:
+            - groups [int]: number of groups on each results page (at most as many as 'found' documents make up)
+            - docs_in_group [int|None]: number of documents in each group (None = as requested)
+            - found [int|None]: total number of documents found (None = enough for MAX_RESULTS groups)
+            - latency, jitter [float]: response delay (sec.) = latency +/- random jitter
+            - failure_rate [float]: share of requests answered with HTTP 503
+            - captcha_rate [float]: share of search requests (without the robot check cookie) answered with a captcha
+            - error_code [int]: if set, answer all search requests with this Yandex error (e.g. 32, 48)
+            - mode [str]: 'world' or 'ru' (limits info format)
+            - limit [int]: number of requests reported for each limits interval
+            - captcha_answer [str]: the right captcha answer
+            - seed [int|None]: random seed for the failure / captcha rates
+            - port [int]: port to listen on (0 = any free port)
+            - compress [int]: gzip level of the responses to the clients accepting gzip (0 = don't compress)
+        """
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.groups = groups
+        self.docs_in_group = docs_in_group
+        self.found = found
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.captcha_rate = captcha_rate
+        self.error_code = error_code
+        self.mode = mode
+        self.limit = limit
+        self.captcha_answer = captcha_answer
+        self.compress = compress
+        self.stats = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._captcha_keys = set()
+        self._responses = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients closing the connection early (e.g. a stopped streaming search) are not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count(self, what, n=1):
+        with self._lock:
+            self.stats[what] = self.stats.get(what, 0) + n
+
+    def random(self, a=0.0, b=1.0):
+        with self._lock:
+            return self._random.uniform(a, b)
+
+    def new_captcha_key(self):
+        with self._lock:
+            key = '{:016x}'.format(self._random.getrandbits(64))
+            self._captcha_keys.add(key)
+            return key
+
+    def check_captcha_key(self, key):
+        with self._lock:
+            if key in self._captcha_keys:
+                self._captcha_keys.discard(key)
+                return True
+            return False
+
+    def search_xml(self, query, page, groups, docs_in_group, found, grouped):
+        # the results pages are generated once per set of parameters, then only the query text is substituted
+        key = (page, groups, docs_in_group, found, grouped)
+        with self._lock:
+            template = self._responses.get(key)
+        if template is None:
+            template = make_search_xml('\x00', page, groups, docs_in_group, found, grouped, hlword='query')
+            with self._lock:
+                self._responses[key] = template
+        return template.replace('\x00', escape(query), 1)